@@ -0,0 +1,81 @@
+import hail as hl
+
+
+# n_samples, n_variants
+SCALES = {
+    'small': (1000, 10000),
+    'medium': (5000, 50000),
+    'large': (20000, 200000)
+}
+
+AUTOSOMES = [str(contig) for contig in range(1, 23)]
+
+
+def synthetic_cohort(n_samples: int, n_variants: int, x_fraction: float = 0.05, sample_missing_rate: float = 0.005,
+                     bad_sample_rate: float = 0.02, variant_missing_rate: float = 0.005, bad_variant_rate: float = 0.02,
+                     sex_mismatch_rate: float = 0.01, hwe_violation_rate: float = 0.01) -> hl.MatrixTable:
+    """
+    Generate a case/control cohort with the same fields as hl.import_plink output. Genotypes come from
+    hl.balding_nichols_model, then missingness, sex mismatches and HWE violations are injected. Reproducible for a
+    given hl.init(global_seed=...)
+    :param n_samples: number of samples
+    :param n_variants: number of variants, spread over chromosomes 1-22 and X
+    :param x_fraction: fraction of the variants placed on non-PAR X
+    :param sample_missing_rate: missing rate of good samples
+    :param bad_sample_rate: fraction of samples with a 10% missing rate
+    :param variant_missing_rate: missing rate of good variants
+    :param bad_variant_rate: fraction of variants with a 10% missing rate
+    :param sex_mismatch_rate: fraction of samples whose reported sex is flipped
+    :param hwe_violation_rate: fraction of variants where heterozygous calls are turned into homozygous alt calls
+    :return: Hail MatrixTable keyed by locus/alleles and s
+    """
+    mt = hl.balding_nichols_model(3, n_samples, n_variants, reference_genome='GRCh37')
+    mt = mt.add_row_index('idx')
+    mt = mt.key_cols_by(s=hl.str(mt.sample_idx)).key_rows_by()
+
+    # place the variants in reference order: autosomes first, the last x_fraction on X after PAR1
+    n_autosomal = int(n_variants * (1 - x_fraction))
+    per_contig = -(-n_autosomal // len(AUTOSOMES))
+    idx = hl.int32(mt.idx)
+    locus = hl.if_else(
+        idx < n_autosomal,
+        hl.locus(hl.literal(AUTOSOMES)[idx // per_contig], 1000000 + (idx % per_contig) * 100,
+                 reference_genome='GRCh37'),
+        hl.locus('X', 3000000 + (idx - n_autosomal) * 100, reference_genome='GRCh37'))
+    mt = mt.annotate_rows(locus=locus,
+                          rsid=hl.format('snp%d', idx),
+                          cm_position=0.0,
+                          variant_missing_rate=hl.if_else(hl.rand_bool(bad_variant_rate), 0.1, variant_missing_rate),
+                          hwe_violation=hl.rand_bool(hwe_violation_rate))
+    mt = mt.key_rows_by('locus', 'alleles')
+
+    mt = mt.annotate_cols(fam_id=mt.s, pat_id=hl.missing(hl.tstr), mat_id=hl.missing(hl.tstr),
+                          true_female=hl.rand_bool(0.5),
+                          is_case=hl.rand_bool(0.5),
+                          sample_missing_rate=hl.if_else(hl.rand_bool(bad_sample_rate), 0.1, sample_missing_rate))
+    mt = mt.annotate_cols(is_female=hl.if_else(hl.rand_bool(sex_mismatch_rate), ~mt.true_female, mt.true_female))
+
+    # males are hemizygous on X, HWE violating variants lose their heterozygotes
+    gt = mt.GT
+    gt = hl.if_else((mt.locus.contig == 'X') & ~mt.true_female & gt.is_het(), hl.call(1, 1), gt)
+    gt = hl.if_else(mt.hwe_violation & gt.is_het(), hl.call(1, 1), gt)
+    gt = hl.or_missing(~hl.rand_bool(hl.max(mt.variant_missing_rate, mt.sample_missing_rate)), gt)
+    mt = mt.annotate_entries(GT=gt)
+
+    return mt.select_rows('rsid', 'cm_position').select_cols('fam_id', 'pat_id', 'mat_id', 'is_female', 'is_case')
+
+
+def cohort_path(workdir: str, scale: str, seed: int) -> str:
+    return '{}cohort_{}_seed{}.mt'.format(workdir, scale, seed)
+
+
+def get_cohort(workdir: str, scale: str, seed: int) -> hl.MatrixTable:
+    """
+    Read the synthetic cohort for a scale, generating and writing it on the first call
+    """
+    path = cohort_path(workdir, scale, seed)
+    if not hl.hadoop_exists(path + '/_SUCCESS'):
+        n_samples, n_variants = SCALES[scale]
+        synthetic_cohort(n_samples, n_variants).write(path, overwrite=True)
+
+    return hl.read_matrix_table(path)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Benchmark the QC steps, collect_counts, the plot builders and run_qc end to end on synthetic cohorts. Runs offline in
+Spark local mode.
+
+    python benchmarks/run_benchmarks.py --scales small medium
+    python benchmarks/run_benchmarks.py --scales small --compare benchmarks/results/<previous>.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import time
+from datetime import datetime
+from typing import Callable, Dict
+
+import hail as hl
+
+import preimp_qc.test_qc as qc
+import preimp_qc.test_plots as plt
+from preimp_qc.functions import run_qc
+
+from cohorts import SCALES, get_cohort
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def timed(results: Dict[str, float], name: str, fn: Callable, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    results[name] = round(time.perf_counter() - start, 3)
+    print('{:<28} {:>10.3f}s'.format(name, results[name]))
+    return out
+
+
+def benchmark_scale(workdir: str, scale: str, seed: int) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    raw_mt = timed(results, 'generate/read cohort', get_cohort, workdir, scale, seed)
+
+    # each step is timed on the same checkpointed metrics so it only measures itself
+    mt = timed(results, 'compute_qc_metrics', lambda m: qc.compute_qc_metrics(m).checkpoint(
+        '{}metrics_{}_seed{}.mt'.format(workdir, scale, seed), overwrite=True), raw_mt)
+
+    timed(results, 'collect_counts', qc.collect_counts, mt)
+    timed(results, 'filter_var_cr', qc.filter_var_cr, mt, 0.02)
+    timed(results, 'filter_sample_cr', qc.filter_sample_cr, mt, 0.02)
+    imputed_sex, _ = timed(results, 'impute_sex', qc.impute_sex, mt)
+    timed(results, 'filter_sex_check', qc.filter_sex_check, mt, imputed_sex, 0.4, 0.8)
+    timed(results, 'sex_violations', qc.sex_violations, mt, imputed_sex, 'plink')
+    timed(results, 'sex_warnings', qc.sex_warnings, mt, imputed_sex, 'plink')
+    timed(results, 'filter_midi', qc.filter_midi, mt, 0.02)
+    timed(results, 'filter_invariant_snps', qc.filter_invariant_snps, mt)
+    timed(results, 'filter_maf', qc.filter_maf, mt, 0.01)
+    timed(results, 'filter_hwe controls', qc.filter_hwe, mt, 'Control', 1e-6)
+    timed(results, 'filter_hwe cases', qc.filter_hwe, mt, 'Case', 1e-10)
+
+    # the plot data extraction run_qc uses (cr_var_data, cr_id_data, fstat_data, man_qq_data) plus the renderers
+    timed(results, 'cr_var_plts', plt.cr_var_plts, mt, 0.02)
+    timed(results, 'cr_id_plts', plt.cr_id_plts, mt, 0.02)
+    timed(results, 'fstat_plt', plt.fstat_plt, imputed_sex, 0.4, 0.8)
+    timed(results, 'man_qq_plts', plt.man_qq_plts, mt)
+
+    timed(results, 'run_qc', run_qc, raw_mt, workdir, 'bench_{}'.format(scale), 'plink', 0.05, 0.02, 0.4, 0.8, 0.02,
+          0.02, 0.01, 1e-6, 1e-10, 1)
+
+    return results
+
+
+def compare(previous: Dict, current: Dict):
+    print('\n{:<10} {:<28} {:>10} {:>10} {:>8}'.format('scale', 'benchmark', 'previous', 'current', 'ratio'))
+    for scale, results in current['scales'].items():
+        old_results = previous['scales'].get(scale, {})
+        for name, seconds in results.items():
+            old = old_results.get(name)
+            ratio = '{:.2f}'.format(seconds / old) if old else '-'
+            print('{:<10} {:<28} {:>10} {:>10.3f} {:>8}'.format(scale, name, old if old is not None else '-',
+                                                               seconds, ratio))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='preimp_qc benchmarks')
+    parser.add_argument('--scales', nargs='+', default=['small'], choices=list(SCALES))
+    parser.add_argument('--workdir', type=str, default='/tmp/preimp_qc_bench/',
+                        help="where the synthetic cohorts and QC outputs are written")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cores', type=str, default='*', help="Spark local cores")
+    parser.add_argument('--compare', type=str, help="previous results JSON to compare against")
+    arg = parser.parse_args()
+
+    os.makedirs(arg.workdir, exist_ok=True)
+    hl.init(master='local[{}]'.format(arg.cores), default_reference='GRCh37', global_seed=arg.seed,
+            tmp_dir=arg.workdir, quiet=True)
+
+    current = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'hail_version': hl.version(),
+        'seed': arg.seed,
+        'scales': {}
+    }
+    for scale in arg.scales:
+        print('\n{} ({} samples, {} variants)'.format(scale, *SCALES[scale]))
+        current['scales'][scale] = benchmark_scale(arg.workdir, scale, arg.seed)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = os.path.join(RESULTS_DIR, '{}_{}.json'.format(current['timestamp'].replace(':', ''), current['git_commit']))
+    with open(out, 'w') as f:
+        json.dump(current, f, indent=2)
+    print('\nResults written to {}'.format(out))
+
+    if arg.compare:
+        with open(arg.compare) as f:
+            compare(json.load(f), current)
+
+
+if __name__ == '__main__':
+    main()
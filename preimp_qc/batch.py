@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import hail as hl
+
+from preimp_qc.engine import add_engine_arguments, init_engine
+from preimp_qc.preimp_qc import build_parser, run
+
+
+def cohort_argv(options: Dict) -> List[str]:
+    """
+    :param options: preimp_qc options of a cohort, keyed by option name without the leading dashes
+    :return: command line arguments
+    """
+    argv = []
+    for name, value in options.items():
+        if value is None or value is False:
+            continue
+        argv.append('--' + name)
+        if isinstance(value, list):
+            argv.extend(str(v) for v in value)
+        elif value is not True:
+            argv.append(str(value))
+
+    return argv
+
+
+def read_manifest(path: str) -> List[argparse.Namespace]:
+    """
+    Read the batch manifest, a JSON list of cohorts or a dict with optional "defaults" and a "cohorts" list. Each cohort
+    is a dict of preimp_qc options (e.g. {"dirname": ..., "basename": ..., "input_type": "plink", "qc_round": 1,
+    "maf": 0.05}), the defaults are applied to every cohort. Every cohort must have its own dirname
+    :param path: manifest path
+    :return: parsed arguments of every cohort
+    """
+    with hl.hadoop_open(path, 'r') as f:
+        manifest = json.load(f)
+
+    if isinstance(manifest, list):
+        manifest = {'cohorts': manifest}
+
+    parser = build_parser()
+    cohorts = []
+    for cohort in manifest['cohorts']:
+        options = dict(manifest.get('defaults', {}), **cohort)
+        cohorts.append(parser.parse_args(cohort_argv(options)))
+
+    # the report, report assets and sweep report are written to the cohort's dirname, concurrent cohorts sharing one
+    # would overwrite each other's
+    dirnames = [cohort.dirname for cohort in cohorts]
+    shared = sorted({dirname for dirname in dirnames if dirnames.count(dirname) > 1})
+    if shared:
+        raise ValueError("every cohort needs its own dirname, shared by several cohorts: {}".format(', '.join(shared)))
+
+    return cohorts
+
+
+def run_cohort(arg: argparse.Namespace, partition_target: int = None) -> Dict:
+    """
+    Run one cohort in its own Spark fair scheduler pool, so concurrent cohorts share the executors, and in its own job
+    group, so its run manifest only profiles its own Spark jobs. Errors are recorded in the summary instead of stopping
+    the batch
+    :param arg: parsed preimp_qc arguments
+    :param partition_target: number of partitions for the imports from the execution profile
+    :return: summary row of the cohort
+    """
+    summary = {'cohort': arg.basename, 'dirname': arg.dirname, 'status': 'done', 'wall_time_s': None,
+               'samples_pre': None, 'samples_post': None, 'snps_pre': None, 'snps_post': None, 'error': None}
+
+    try:
+        sc = hl.spark_context()
+        sc.setLocalProperty('spark.scheduler.pool', arg.basename)
+        sc.setJobGroup(arg.dirname + arg.basename, 'preimp_qc cohort {}'.format(arg.basename))
+    except Exception:
+        # only the Spark backend has scheduler pools and job groups
+        pass
+
+    start = time.perf_counter()
+    try:
+        run(arg, partition_target)
+    except Exception as e:
+        traceback.print_exc()
+        summary['status'] = 'failed'
+        summary['error'] = '{}: {}'.format(type(e).__name__, e)
+    summary['wall_time_s'] = round(time.perf_counter() - start, 3)
+
+    # row and column counts come from the run manifest of the cohort
+    run_manifest = arg.dirname + arg.basename + '_run_manifest.json'
+    if summary['status'] == 'done' and not arg.sweep and hl.hadoop_exists(run_manifest):
+        with hl.hadoop_open(run_manifest, 'r') as f:
+            stages = json.load(f)['stages']
+        summary['samples_pre'], summary['snps_pre'] = stages[0]['cols_out'], stages[0]['rows_out']
+        summary['samples_post'], summary['snps_post'] = stages[-1]['cols_out'], stages[-1]['rows_out']
+
+    return summary
+
+
+def write_summary(summaries: List[Dict], summary_dir: str):
+    """
+    Write the combined summary of the batch to summary_dir/batch_summary.tsv and batch_summary.html
+    :param summaries: summary rows returned by run_cohort
+    :param summary_dir: output directory
+    """
+    import pandas as pd
+
+    summary = pd.DataFrame(summaries, columns=['cohort', 'dirname', 'status', 'wall_time_s', 'samples_pre',
+                                               'samples_post', 'snps_pre', 'snps_post', 'error'])
+    summary.to_csv(summary_dir + 'batch_summary.tsv', sep='\t', index=False)
+    with open(summary_dir + 'batch_summary.html', 'w') as f:
+        f.write('<!doctype html>\n<html lang="en">\n<head><meta charset="utf-8"><title>preimpQC batch</title></head>\n'
+                '<body style="margin:100px;padding:35px">\n<h1 style="font-weight:normal">preimpQC batch summary</h1>\n'
+                + summary.to_html(index=False) + '\n</body>\n</html>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='preimp_qc batch runner')
+    parser.add_argument('--manifest', type=str, required=True,
+                        help="JSON list of cohorts, each a dict of preimp_qc options")
+    parser.add_argument('--max_concurrent', type=int, default=2,
+                        help="number of cohorts run at the same time in the Hail session")
+    parser.add_argument('--summary_dir', type=str, default='./', help="where the combined summary is written")
+    parser.add_argument('--reference', type=str, default='GRCh38',
+                        help="default reference of the Hail session, the cohorts pass their own to the readers")
+    add_engine_arguments(parser)
+    arg = parser.parse_args()
+
+    # one JVM/Spark session for the whole batch, with a fair scheduler so the cohorts' jobs overlap
+    partition_target = init_engine(arg.profile, arg.reference, arg.cores, arg.driver_memory, arg.tmp_dir, arg.log,
+                                   arg.spark_conf, {'spark.scheduler.mode': 'FAIR'})
+
+    cohorts = read_manifest(arg.manifest)
+
+    # plot rendering runs in per-cohort process pools, share the cores between the concurrent cohorts
+    plot_workers = max(1, (os.cpu_count() or 1) // arg.max_concurrent)
+    for cohort in cohorts:
+        if cohort.plot_workers is None:
+            cohort.plot_workers = plot_workers
+
+    with ThreadPoolExecutor(max_workers=arg.max_concurrent) as executor:
+        summaries = list(executor.map(lambda cohort: run_cohort(cohort, partition_target), cohorts))
+
+    write_summary(summaries, arg.summary_dir)
+
+    n_failed = sum(summary['status'] == 'failed' for summary in summaries)
+    print("\nDone running {} cohorts ({} failed)".format(len(summaries), n_failed))
+
+
+if __name__ == '__main__':
+    main()
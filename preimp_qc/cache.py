@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Callable, Dict, List
+
+import hail as hl
+
+import preimp_qc.test_qc as qc
+
+# bump when the cached MatrixTable layout or the precomputed metrics change
+CACHE_VERSION = 3
+
+
+def file_fingerprint(path: str, hash_contents: bool = False) -> Dict:
+    """
+    :param path: local or remote (Hadoop-readable) file path
+    :param hash_contents: also hash the file contents, slower but robust to copies that reset the mtime
+    :return: dict with the path, size, modification time and optional sha256
+    """
+    stat = hl.hadoop_stat(path)
+    fingerprint = {'path': path, 'size': stat['size_bytes'], 'mtime': stat['modification_time']}
+
+    if hash_contents:
+        sha = hashlib.sha256()
+        with hl.hadoop_open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        fingerprint['sha256'] = sha.hexdigest()
+
+    return fingerprint
+
+
+def input_key(paths: List[str], reference: str, annotations: str = None, hash_contents: bool = False,
+              options: Dict = None) -> str:
+    """
+    Content address of a converted input: fingerprints of the input (and annotations) files, the reference genome and
+    any import options
+    :return: hex digest
+    """
+    files = [file_fingerprint(path, hash_contents) for path in paths]
+    if annotations:
+        files.append(file_fingerprint(annotations, hash_contents))
+
+    description = {'version': CACHE_VERSION, 'files': files, 'reference': reference, 'options': options or {}}
+
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def evict(cache_dir: str, max_size_gb: float, keep: str = None):
+    """
+    Remove the least recently used entries until the cache is below max_size_gb. Only local cache directories are
+    evicted
+    :param cache_dir: cache directory
+    :param max_size_gb: size limit in GB
+    :param keep: entry path that is never evicted
+    """
+    if '://' in cache_dir or not os.path.isdir(cache_dir):
+        return
+
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.mt')]
+    entries = sorted(entries, key=os.path.getmtime)
+    sizes = {entry: dir_size(entry) for entry in entries}
+    total = sum(sizes.values())
+
+    for entry in entries:
+        if total <= max_size_gb * 1024 ** 3:
+            break
+        if entry == keep:
+            continue
+        print("Evicting {} from the input cache".format(entry))
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+
+
+def cached_input(cache_dir: str, key: str, convert: Callable[[], hl.MatrixTable],
+                 max_size_gb: float = 50) -> hl.MatrixTable:
+    """
+    Read the converted input from the cache, or convert it, compute the base QC metrics and write it to the cache
+    :param cache_dir: cache directory
+    :param key: input_key of the input
+    :param convert: function importing the raw input
+    :param max_size_gb: size limit of the cache in GB
+    :return: native Hail MatrixTable with variant_metrics and sample_metrics
+    """
+    path = '{}{}.mt'.format(cache_dir, key)
+
+    if hl.hadoop_exists(path + '/_SUCCESS'):
+        print("Reading converted input from the cache: {}".format(path))
+        if os.path.isdir(path):
+            # mark as recently used
+            os.utime(path)
+    else:
+        print("Converting input into the cache: {}".format(path))
+        qc.compute_qc_metrics(convert()).write(path, overwrite=True)
+        evict(cache_dir, max_size_gb, keep=path)
+
+    return hl.read_matrix_table(path)
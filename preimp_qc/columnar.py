@@ -0,0 +1,176 @@
+import json
+from typing import Dict, List
+
+# Hail is only imported by the writers. The readers and rebuild_report run without a Spark session: pyarrow, numpy
+# and the plot renderers only
+
+STAGES = ['pre_qc', 'post_qc']
+
+
+def metrics_dir(dirname: str, basename: str) -> str:
+    """
+    :return: directory of the columnar QC metrics, <dirname><basename>_qc_metrics/ with one
+    <stage>_{variants,samples}.parquet per stage in STAGES and pre_qc_fstat.parquet
+    """
+    return '{}{}_qc_metrics/'.format(dirname, basename)
+
+
+def variant_table(mt, gwas_ht):
+    """
+    :param mt: Hail MatrixTable with variant_metrics
+    :param gwas_ht: Hail Table keyed by locus and alleles with the association p_value (test_plots.association_ht)
+    :return: Hail Table with the per-variant metrics of the report, keyed by locus and alleles
+    """
+    import hail as hl
+
+    variants = mt.rows()
+    vm = variants.variant_metrics
+    variants = variants.select(rsid=variants.rsid, call_rate=vm.call_rate, call_rate_cases=vm.call_rate_cases,
+                               call_rate_controls=vm.call_rate_controls, maf=hl.min(vm.AF),
+                               p_value_hwe=vm.p_value_hwe, p_value_hwe_cases=vm.p_value_hwe_cases,
+                               p_value_hwe_controls=vm.p_value_hwe_controls, p_value_missing=vm.p_value_missing,
+                               missing_diff=vm.missing_diff)
+
+    return variants.annotate(p_value=gwas_ht[variants.key].p_value)
+
+
+def sample_table(mt):
+    """
+    :param mt: Hail MatrixTable with sample_metrics
+    :return: Hail Table with the per-sample metrics of the report
+    """
+    samples = mt.cols()
+
+    return samples.select(is_case=samples.is_case, is_female=samples.is_female,
+                          call_rate=samples.sample_metrics.call_rate)
+
+
+def write_parquet(ht, path: str):
+    """
+    Write a Hail Table as Parquet from the executors, with flat columns: the key is dropped, locus is split into
+    contig and position and alleles are comma-delimited
+    :param ht: Hail Table
+    :param path: output directory (one Parquet file per partition)
+    """
+    import hail as hl
+
+    ht = ht.key_by()
+    if 'locus' in ht.row:
+        ht = ht.select(contig=ht.locus.contig, position=ht.locus.position, alleles=hl.delimit(ht.alleles, ','),
+                       **{name: ht[name] for name in ht.row if name not in ['locus', 'alleles']})
+    ht.to_spark(flatten=True).write.mode('overwrite').parquet(path)
+
+
+def write_qc_metrics(variants, samples, path: str, stage: str):
+    """
+    :param variants: variant_table output
+    :param samples: sample_table output
+    :param path: metrics_dir
+    :param stage: one of STAGES
+    """
+    write_parquet(variants, '{}{}_variants.parquet'.format(path, stage))
+    write_parquet(samples, '{}{}_samples.parquet'.format(path, stage))
+
+
+def read_columns(path: str, columns: List[str]):
+    """
+    Read columns of a Parquet export without Spark. The files are memory-mapped and only the requested columns are
+    decoded
+    :param path: Parquet file or directory written by write_parquet
+    :param columns: column names
+    :return: pyarrow Table
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_table(path, columns=columns, memory_map=True)
+
+
+def to_numpy(table, column: str, numeric: bool = True):
+    """
+    :param table: pyarrow Table
+    :param column: column name
+    :param numeric: cast to float64 like test_plots.collect_arrays (booleans become 1.0/0.0, nulls NaN)
+    :return: NumPy array
+    """
+    values = table.column(column)
+    if numeric:
+        values = values.cast('float64')
+    # no zero_copy_only keyword, older pyarrow releases take no arguments (a chunked array is copied anyway)
+    return values.to_numpy()
+
+
+def read_manifest(dirname: str, basename: str) -> Dict:
+    with open(dirname + basename + '_run_manifest.json') as f:
+        return json.load(f)
+
+
+def stage_plot_data(path: str, stage: str, reference: Dict) -> Dict:
+    """
+    Rebuild the plot data of a stage (same format as the plot_data of run_qc) from its Parquet export
+    :param path: metrics_dir
+    :param stage: one of STAGES
+    :param reference: test_plots.reference_lengths of the reference genome, from the run manifest
+    :return: dict with the variant and sample call rate histograms and the Manhattan/QQ data
+    """
+    import preimp_qc.test_plots as plt
+
+    variants = read_columns('{}{}_variants.parquet'.format(path, stage),
+                            ['contig', 'position', 'call_rate_cases', 'call_rate_controls', 'p_value'])
+    samples = read_columns('{}{}_samples.parquet'.format(path, stage), ['is_case', 'call_rate'])
+
+    is_case = to_numpy(samples, 'is_case')
+    sample_cr = to_numpy(samples, 'call_rate')
+
+    return {'var': {'cases': plt.cr_hist_array(to_numpy(variants, 'call_rate_cases')),
+                    'controls': plt.cr_hist_array(to_numpy(variants, 'call_rate_controls'))},
+            'id': {'cases': plt.cr_hist_array(sample_cr[is_case == 1]),
+                   'controls': plt.cr_hist_array(sample_cr[is_case == 0])},
+            'man_qq': plt.manhattan_qq_arrays(plt.global_positions(to_numpy(variants, 'contig', numeric=False),
+                                                                   to_numpy(variants, 'position'), **reference),
+                                              to_numpy(variants, 'p_value'), **reference)}
+
+
+def rebuild_report(dirname: str, basename: str, mind: float = None, geno: float = None, fhet_y: float = None,
+                   fhet_x: float = None, asset_mode: str = 'inline', report_timings: bool = False,
+                   plot_workers: int = None):
+    """
+    Rebuild report.html from the run manifest and the Parquet QC metrics of a previous run, without Hail or Spark.
+    The thresholds only move the lines drawn on the plots, the exclusion counts are those of the run. A threshold left
+    None is the one of the run, from the manifest params
+    :param dirname: output directory of the run
+    :param basename: data basename
+    :param mind: sample call rate threshold drawn on the sample call rate plots
+    :param geno: variant call rate threshold drawn on the variant call rate plots
+    :param fhet_y: female F-stat threshold
+    :param fhet_x: male F-stat threshold
+    :param asset_mode: one of report.REPORT_ASSET_MODES
+    :param report_timings: add the per-stage timing table of the run
+    :param plot_workers: number of plot rendering processes
+    """
+    import preimp_qc.test_plots as plt
+    from preimp_qc.report import generate_tables, timings_html, write_html_report
+
+    manifest = read_manifest(dirname, basename)
+    report = manifest['report']
+    path = metrics_dir(dirname, basename)
+    params = manifest['params']
+    mind = params['mind'] if mind is None else mind
+    geno = params['geno'] if geno is None else geno
+    fhet_y = params['fhet_y'] if fhet_y is None else fhet_y
+    fhet_x = params['fhet_x'] if fhet_x is None else fhet_x
+
+    qc_tables_list = list(generate_tables(report['pre_qc_counts'], report['post_qc_counts'], report['filter_counts']))
+    qc_tables_list.append(timings_html(manifest['stages']) if report_timings else None)
+
+    # only the metrics recorded in the manifest are used, a metrics directory left by another run is ignored
+    qc_plots_list = None
+    if report.get('metrics'):
+        with plt.plot_pool(plot_workers) as pool:
+            plots = {stage: plt.submit_plots(pool, stage_plot_data(path, stage, report['reference']), mind, geno)
+                     for stage in STAGES}
+            fstat = read_columns(path + 'pre_qc_fstat.parquet', ['is_female', 'f_stat'])
+            fstat = {name: to_numpy(fstat, name) for name in ['is_female', 'f_stat']}
+            f_stat_plot = pool.submit(plt.render_fstat, fstat, fhet_y, fhet_x)
+            qc_plots_list = plt.collect_plots(plots['pre_qc'], plots['post_qc'], f_stat_plot)
+
+    write_html_report(dirname, basename, qc_tables_list, qc_plots_list, asset_mode)
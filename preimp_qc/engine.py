@@ -0,0 +1,114 @@
+import argparse
+import os
+from typing import Dict, List
+
+# local profiles run Spark in the driver JVM: master local[cores], the driver heap is a fraction of the RAM and the
+# imports target a number of partitions per core. The cluster profile keeps the cluster's master and driver settings
+PROFILES = {
+    'laptop': {'local': True, 'memory_fraction': 0.5, 'partitions_per_core': 2},
+    'big-node': {'local': True, 'memory_fraction': 0.8, 'partitions_per_core': 3},
+    'cluster': {'local': False, 'memory_fraction': None, 'partitions_per_core': 3}
+}
+
+
+def available_cores() -> int:
+    # cores this process may run on (cgroup/affinity aware on Linux)
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# memory limit of the container: cgroup v2, then v1. 'max' (v2) or a huge value (v1) mean no limit
+CGROUP_MEMORY_LIMITS = ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']
+
+
+def cgroup_memory_gb() -> float:
+    """
+    :return: memory limit of the cgroup of this process in GB, None if there is no limit
+    """
+    for path in CGROUP_MEMORY_LIMITS:
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            return int(limit) / 1024 ** 3
+    return None
+
+
+def available_memory_gb() -> float:
+    """
+    :return: memory in GB this process may use, the cgroup limit if lower than the physical memory. None if it cannot
+    be detected
+    """
+    try:
+        memory_gb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        memory_gb = None
+
+    limit_gb = cgroup_memory_gb()
+    if memory_gb is None or (limit_gb is not None and limit_gb < memory_gb):
+        return limit_gb
+    return memory_gb
+
+
+def add_engine_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--profile', type=str, choices=list(PROFILES),
+                        help="execution profile: laptop, big-node (local Spark sized from the detected cores and RAM) "
+                             "or cluster (the cluster's Spark settings). If not set, Hail's defaults are used")
+    parser.add_argument('--cores', type=int,
+                        help="local Spark cores, overrides the detected cores (ignored by the cluster profile)")
+    parser.add_argument('--driver_memory', type=str, help="Spark driver memory, e.g. 16g, overrides the profile")
+    parser.add_argument('--tmp_dir', type=str, help="Hail temporary directory")
+    parser.add_argument('--log', type=str, help="Hail log file")
+    parser.add_argument('--spark_conf', type=str, nargs='+', default=[], metavar='KEY=VALUE',
+                        help="extra Spark configuration")
+
+
+def init_engine(profile: str = None, reference: str = 'GRCh38', cores: int = None, driver_memory: str = None,
+                tmp_dir: str = None, log: str = None, spark_conf: List[str] = None,
+                extra_conf: Dict[str, str] = None) -> int:
+    """
+    Initialise Hail for an execution profile
+    :param profile: one of PROFILES, or None for Hail's defaults
+    :param reference: default reference genome
+    :param cores: local cores, defaults to the detected cores
+    :param driver_memory: driver memory, defaults to the profile's fraction of the detected RAM
+    :param tmp_dir: Hail temporary directory
+    :param log: Hail log file
+    :param spark_conf: KEY=VALUE Spark settings, applied last
+    :param extra_conf: Spark settings required by the caller (e.g. the batch scheduler mode)
+    :return: target number of partitions for the imports, None without a profile
+    """
+    import hail as hl
+
+    conf = dict(extra_conf or {})
+    master = None
+    settings = PROFILES.get(profile)
+
+    if settings and settings['local']:
+        cores = cores if cores else available_cores()
+        master = 'local[{}]'.format(cores)
+        memory_gb = available_memory_gb()
+        if driver_memory is None and memory_gb:
+            driver_memory = '{}g'.format(max(1, int(memory_gb * settings['memory_fraction'])))
+    elif cores and settings is None:
+        # --cores without a profile runs local Spark, the cluster profile keeps the cluster's master
+        master = 'local[{}]'.format(cores)
+
+    if driver_memory:
+        conf['spark.driver.memory'] = driver_memory
+    for setting in spark_conf or []:
+        key, value = setting.split('=', 1)
+        conf[key] = value
+
+    hl.init(master=master, default_reference=reference, tmp_dir=tmp_dir, log=log, spark_conf=conf or None)
+
+    if settings is None:
+        return None
+
+    if settings['local']:
+        return cores * settings['partitions_per_core']
+    # on a cluster, size the imports from the executors Spark has
+    return hl.spark_context().defaultParallelism * settings['partitions_per_core']
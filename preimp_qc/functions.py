@@ -1,53 +1,20 @@
 import hail as hl
-from typing import List, Tuple
 
 import preimp_qc.test_qc as qc
 import preimp_qc.test_plots as plt
-
-
-def compute_qc_metrics(mt: hl.MatrixTable) -> hl.MatrixTable:
-    """
-    Compute per-sample metrics and common variant statistics useful for quality control
-    :param mt: Hail MatrixTable
-    :return: Hail MatrixTable with variant and sample qc metrics
-    """
-    mt = hl.variant_qc(mt)
-    mt = hl.sample_qc(mt)
-
-    return mt
-
-
-# TESTED: WORKING
-def stats_split_mt(mt: hl.MatrixTable) -> Tuple[List[int], hl.MatrixTable, hl.MatrixTable]:
-    """
-    Collect basic stat counts and split the MatrixTable by phenotype status (for plots)
-    :param mt: Hail MatrixTable
-    :return: basic stat counts, cases MatrixTable, controls MatrixTable
-    """
-    # 1. Sex
-    n_females: List[str] = mt.filter_cols(mt.is_female == True).s.collect()
-    n_males: List[str] = mt.filter_cols(mt.is_female == False).s.collect()
-    n_sex_missing: List[str] = mt.filter_cols(hl.is_missing(mt.is_female)).s.collect()
-
-    # 2. Phenotype status
-    mt_cases: hl.MatrixTable = mt.filter_cols(mt.is_case == True)
-    n_cases: int = mt_cases.count_cols()
-    mt_controls: hl.MatrixTable = mt.filter_cols(mt.is_case == False)
-    n_controls: int = mt_controls.count_cols()
-    n_unknown_pheno: List[str] = mt.filter_cols(hl.is_missing(mt.is_case)).s.collect()
-
-    # 3. Number of SNPs
-    n_snps = mt.count_rows()
-
-    counts: List[int] = [len(n_males), len(n_females), len(n_sex_missing), n_cases,
-                         n_controls, len(n_unknown_pheno), n_snps]
-
-    return counts, mt_cases, mt_controls
+import preimp_qc.shards as shards
+import preimp_qc.columnar as columnar
+from preimp_qc.instrumentation import RunRecorder
+from preimp_qc.report import generate_tables
+from preimp_qc.stages import StageRunner
 
 
 def run_qc(mt: hl.MatrixTable, dirname: str, basename: str, input_type: str, pre_geno: float, mind: float, fhet_y: int,
            fhet_x: int, geno: float, midi: float, maf: float, hwe_th_co: float, hwe_th_ca: float, qc_round: int,
-           withpna: int = 0) -> hl.MatrixTable:
+           withpna: int = 0, checkpoint_dir: str = None, checkpoint_policy: str = None, report_timings: bool = False,
+           association: str = 'regression', plot_workers: int = None,
+           metrics_computed: bool = False, input_key: str = None, resume: bool = False, variant_shards: int = 0,
+           shard_bp: int = None, plots: bool = True) -> hl.MatrixTable:
     """
     :param mt: Hail MatrixTable
     :param dirname:
@@ -64,151 +31,284 @@ def run_qc(mt: hl.MatrixTable, dirname: str, basename: str, input_type: str, pre
     :param hwe_th_ca:
     :param qc_round:
     :param withpna:
+    :param checkpoint_dir: directory for stage checkpoints, if None stages are persisted in memory
+    :param checkpoint_policy: one of options.CHECKPOINT_POLICIES. Defaults to samples with a checkpoint_dir, none
+    otherwise
+    :param report_timings: add the per-stage timing table to the report. The run manifest is always written
+    :param association: association test for the Manhattan/QQ plots, one of options.ASSOCIATION_MODES
+    :param plot_workers: number of plot rendering processes, defaults to the number of cores
+    :param metrics_computed: the input already carries the base variant_metrics and sample_metrics (cached inputs)
+    :param input_key: fingerprint of the input, the root of the stage keys
+    :param resume: store every stage under a key of its input and parameters in checkpoint_dir (or
+    dirname/preimp_qc_stages/) and reuse the stages whose key is unchanged
+    :param variant_shards: if > 0, run steps 6-11 on genomic shards with this many concurrent Hail jobs
+    :param shard_bp: shard length in bp, one shard per contig if None
+    :param plots: extract and render the plots. If False, no plot data (and no association regression) is computed
+    and no plots are returned. The pre/post-QC metrics behind the plots are always written as Parquet to
+    columnar.metrics_dir (with the allelic p value if False), so the report can be rebuilt with --report_only
     :return:
     """
 
-    # compute qc metrics
-    mt = qc.compute_qc_metrics(mt)
-
-    # Pre-qc counts
-    pre_qc_counts = qc.collect_counts(mt)
-
-    # pre-qc plots
-    print("Generating pre-QC plots")
-    pre_cas_var_base64, pre_con_var_base64 = plt.cr_var_plts(mt, geno)
-    pre_cas_id_base64, pre_con_id_base64 = plt.cr_id_plts(mt, mind)
-
-    pre_man_qq_base64 = plt.man_qq_plts(mt)
-
-    # 1. SNP QC: call rate ≥ 0.95
-    print("1. SNP QC: call rate ≥ 0.95")
-    mt, var_pre_filter = qc.filter_var_cr(mt, pre_geno)
-    print("Pre QC call rate < 0.95: {}".format(var_pre_filter['geno_removed']))
-    print("Samples: {}".format(mt.count_cols()))
-
-    # 2. Sample QC: call rate in cases or controls ≥ 0.98
-    print("2. Sample QC: call rate in cases or controls ≥ 0.98")
-    mt, id_cr_filter = qc.filter_sample_cr(mt, mind)
-    print("Sample QC < 0.98: {}".format(id_cr_filter['sample_miss_cases'] + id_cr_filter['sample_miss_controls']))
-    print("Samples: {}".format(mt.count_cols()))
-
-    # 3. Sample QC: F_stats
-    print("3. Sample QC: F_stats")
-    
-    mt, f_stat_results = qc.filter_sex_check(mt, fhet_y, fhet_x)
-    print("Sex check filtered: {}".format(f_stat_results['sex_check_removed']))
-    print("Samples: {}".format(mt.count_cols()))
-
-    # 4. Sample QC: Sex violations (excluded) - genetic sex does not match pedigree sex
-    print("4. Sample QC: Sex violations (excluded) - genetic sex does not match pedigree sex")
-    mt, sex_violations = qc.sex_violations(mt, input_type)
-    print("Sex violations: {}".format(sex_violations['sex_excluded']))
-    print("Samples: {}".format(mt.count_cols()))
-
-    # 5. Sample QC: Sex warnings (not excluded) - undefined phenotype / ambiguous genotypes
-    print("# 5. Sample QC: Sex warnings (not excluded) - undefined phenotype / ambiguous genotypes")
-    sex_warnings_count = qc.sex_warnings(mt, input_type)
-    print("Sex warning: {}".format(sex_warnings_count))
-    print("Samples: {}".format(mt.count_cols()))
-
-    # 6. SNP QC: call rate ≥ 0.98
-    print("# 6. SNP QC: call rate ≥ 0.98")
-    mt, var_filter = qc.filter_var_cr(mt, geno)
-    print("SNP QC call rate < 0.98: {}".format(var_filter['geno_removed']))
-    print("Samples: {}".format(mt.count_cols()))
-
-    # 7. SNP QC: missing difference > 0.02
-    print("# 7. SNP QC: missing difference > 0.02")
-
-    # 8. SNP QC: SNPs with no valid association p value are excluded (i.e., invariant SNP)
-    print("# 8. SNP QC: SNPs with no valid association p value are excluded (i.e., invariant SNP)")
-    if withpna == 0:
-        mt, invariant_snps = qc.filter_invariant_snps(mt)
-        print("Monormorphic SNPs: {}".format(invariant_snps['monomorphic_snps']))
-        print("Samples: {}".format(mt.count_cols()))
-
-    # 9. SNP QC: with MAF ≥ 0.01
-    print("# 9. SNP QC: with MAF ≥ 0.01")
-    mt, maf_results = qc.filter_maf(mt, maf)
-    print("MAF: {}".format(maf_results['maf_removed']))
-    print("Samples: {}".format(mt.count_cols()))
-
-    # 10. SNP QC: Hardy-Weinberg equilibrium (HWE) in controls p value ≥ 1e-06
-    print("# 10. SNP QC: Hardy-Weinberg equilibrium (HWE) in controls p value ≥ 1e-06")
-    mt, hwe_con_results = qc.filter_hwe(mt, 'Control', hwe_th_co)
-    print("HWE Controls: {}".format(hwe_con_results['maf_removed']))
-    print("Samples: {}".format(mt.count_cols()))
-
-    # 11. SNP QC: Hardy-Weinberg equilibrium (HWE) in cases p value ≥ 1e-10
-    print("# 11. SNP QC: Hardy-Weinberg equilibrium (HWE) in cases p value ≥ 1e-10")
-    mt, hwe_cas_results = qc.filter_hwe(mt, 'Case', hwe_th_ca)
-    print("HWE Cases: {}".format(hwe_cas_results['maf_removed']))
-    print("Samples: {}".format(mt.count_cols()))
-
-    # Post-qc counts
-    post_qc_counts = qc.collect_counts(mt)
-
-    # Post-QC plots
-    print("Generating post-QC plots")
-    print("Generating variant call rate plots")
-    pos_cas_var_base64, pos_con_var_base64 = plt.cr_var_plts(mt, geno)
-    print("Generating sample call rate plots")
-    pos_cas_id_base64, pos_con_id_base64 = plt.cr_id_plts(mt, mind)
-    print("Generating Manhattand & QQ plots")
-    pos_man_qq_base64 = plt.man_qq_plts(mt)
-
-    # # pre_cas_var_base64, pre_cas_id_base64, pre_con_var_base64, pre_con_id_base64
-    qc_plots_list = [pre_man_qq_base64, pos_man_qq_base64, pre_con_id_base64, pre_cas_id_base64, pos_con_id_base64, pos_cas_id_base64,
-                     f_stat_results['sex_check_plot'], pre_con_var_base64, pre_cas_var_base64, pos_con_var_base64, pos_cas_var_base64]
-
-    # Tables
-    filter_counts_list = [var_pre_filter['geno_removed'], id_cr_filter['sample_miss_cases'] + id_cr_filter['sample_miss_controls'],
-                          f_stat_results['sex_check_removed'], sex_violations['sex_excluded'], sex_warnings_count,
-                          var_filter['geno_removed'], invariant_snps['monomorphic_snps'],
-                          hwe_con_results['maf_removed'], hwe_cas_results['maf_removed']]
-    size_of_sample_html, exlusion_overview_html = generate_tables(pre_qc_counts, post_qc_counts, filter_counts_list)
-    qc_tables_list = [size_of_sample_html, exlusion_overview_html]
-
-    outplink = dirname + basename + '_qc{}'.format(qc_round)
-    hl.export_plink(mt, outplink)
-
-    return qc_tables_list, qc_plots_list
-
-
-def generate_tables(pre_qc_counts, post_qc_counts, filter_counts):
-    import pandas as pd
-    # this function is for generating the tables in the Generak Info section
-    # HAVE TO WORK ON FLAGS TABLE
-
-    # Size of Sample table
-    pre_qc_pheno_counts = [pre_qc_counts[3], pre_qc_counts[4], pre_qc_counts[5]]
-    post_qc_pheno_counts = [post_qc_counts[3], post_qc_counts[4], post_qc_counts[5]]
-    ex_pheno = [x1 - x2 for x1, x2 in zip(pre_qc_pheno_counts, post_qc_pheno_counts)]
-    pre_qc_sex_counts = [pre_qc_counts[0], pre_qc_counts[1], pre_qc_counts[2]]
-    post_qc_sex_counts = [post_qc_counts[0], post_qc_counts[1], post_qc_counts[2]]
-    ex_sex = [x1 - x2 for x1, x2 in zip(pre_qc_sex_counts, post_qc_sex_counts)]
-    n_snps_pre = pre_qc_counts[6]
-    n_snps_post = post_qc_counts[6]
-    ex_snps = n_snps_pre - n_snps_post
-    size_of_sample = [['Cases,Controls,Missing', pre_qc_pheno_counts, post_qc_pheno_counts, ex_pheno],
-                      ['Males,Females,Unspec', pre_qc_sex_counts, post_qc_sex_counts, ex_sex],
-                      ['SNPs', n_snps_pre, n_snps_post, ex_snps]]
-    size_of_sampledf = pd.DataFrame(size_of_sample, columns=['Test', 'pre QC', 'post QC', 'exclusion-N'])
-    size_of_sample_html = size_of_sampledf.to_html()
-
-    # Exlusion overview table
-    snps_cr_95 = ['SNPs: call rate < 0.950 (pre-filter)', filter_counts[0]]
-    ids_cr = ['IDS: call rate (cases/controls) < 0.980', filter_counts[1]]
-    ids_fhet = ['IDs: FHET outside +- 0.20 (cases/controls)', filter_counts[2]]
-    ids_sex_violations = ['IDs: Sex violations -excluded- (N-tested)', filter_counts[3]]
-    ids_sex_warnings = ['IDs: Sex warnings (undefined genotype/ambigous genotype)', filter_counts[4]]
-    snps_cr_98 = ['SNPs: call rate < 0.980', filter_counts[5]]
-    snps_monomorphic = ['SNPs: without valid association p-value (invariant)', filter_counts[6]]
-    snps_hwe_con = ['SNPs: HWE-controls < -6', filter_counts[7]]
-    snps_hwe_cas = ['SNPs: HWE-cases < -10', filter_counts[8]]
-    exlusion_overview = [snps_cr_95, ids_cr, ids_fhet, ids_sex_violations, ids_sex_warnings, snps_cr_98,
-                         snps_monomorphic, snps_hwe_con, snps_hwe_cas]
-    exlusion_overviewdf = pd.DataFrame(exlusion_overview, columns=['Filter', 'N'])
-    exlusion_overview_html = exlusion_overviewdf.to_html()
-
-    return size_of_sample_html, exlusion_overview_html
\ No newline at end of file
+    # a checkpoint directory without a policy cuts the pipeline after the sample filters
+    if checkpoint_policy is None:
+        checkpoint_policy = 'samples' if checkpoint_dir else 'none'
+
+    # every shard reads the output of sample QC, which must not be recomputed per shard
+    if variant_shards and checkpoint_policy == 'none':
+        checkpoint_policy = 'samples'
+
+    stage_dir = None
+    if resume:
+        stage_dir = checkpoint_dir if checkpoint_dir else dirname + 'preimp_qc_stages/'
+    stages = StageRunner(basename, input_key, stage_dir, checkpoint_dir, checkpoint_policy)
+
+    recorder = RunRecorder()
+
+    # the filters mark the rows and columns they exclude with a reason code, the exclusion tables are written at the end
+    mt = qc.init_exclusions(mt)
+
+    # compute qc metrics and pre-qc counts
+    with recorder.stage('pre-QC metrics and counts'):
+        if not metrics_computed:
+            mt, _ = stages.run(mt, 'metrics', {}, lambda m: (qc.compute_qc_metrics(m), {}))
+        pre_qc_counts = stages.results(mt, 'pre_qc_counts', {}, qc.collect_counts)
+        recorder.n_rows, recorder.n_cols = pre_qc_counts[6], sum(pre_qc_counts[:3])
+
+    # the pre/post-QC metrics are written as Parquet whether or not plots are drawn, so the report can be built later.
+    # Without plots the regression is skipped and the exported p_value is the allelic test from the QC counts
+    metrics_path = columnar.metrics_dir(dirname, basename)
+    metrics_association = association if plots else 'allelic'
+
+    # plots are rendered in a process pool from the extracted plot data while the next Hail stages run
+    pool = plt.plot_pool(plot_workers) if plots else None
+    try:
+        def stage_metrics(m):
+            m = qc.included(m)
+            # the association test runs once, its result feeds both the Manhattan/QQ data and the Parquet metrics
+            variants = columnar.variant_table(m, plt.association_ht(m, metrics_association))
+            plot_data = None
+            if plots:
+                variants = variants.checkpoint(hl.utils.new_temp_file())
+                plot_data = {'var': plt.cr_var_data(m), 'id': plt.cr_id_data(m),
+                             'man_qq': plt.manhattan_qq_data(variants)}
+            return {'variants': variants, 'samples': columnar.sample_table(m), 'plots': plot_data}
+
+        def export_metrics(m, stage):
+            # the metrics tables are stored with the stage results and the Parquet files are written from them on every
+            # run, so a resumed stage never leaves the Parquet files of another run in metrics_path
+            results = stages.results(m, stage + '_metrics', {'association': metrics_association, 'plots': plots},
+                                     stage_metrics)
+            columnar.write_qc_metrics(results['variants'], results['samples'], metrics_path, stage)
+            # returns the futures of the stage's plots, None without plots
+            return plt.submit_plots(pool, results['plots'], mind, geno) if plots else None
+
+        # pre-qc metrics and plots
+        print("Exporting pre-QC metrics")
+        with recorder.stage('pre-QC metrics export'):
+            pre_plots = export_metrics(mt, 'pre_qc')
+
+        # 1. SNP QC: call rate ≥ 0.95
+        print("1. SNP QC: call rate ≥ 0.95")
+
+        def step1(m):
+            m, results = qc.filter_var_cr(m, pre_geno, 'pre_geno')
+            # removing variants invalidates the per-sample call rates, the variant metrics are still valid
+            return qc.compute_sample_metrics(m), results
+
+        with recorder.stage('1. SNP QC: call rate') as stage:
+            mt, var_pre_filter = stages.run(mt, 'step1', {'pre_geno': pre_geno}, step1)
+            stage['rows_removed'] = var_pre_filter['geno_removed']
+        print("Pre QC call rate < 0.95: {}".format(var_pre_filter['geno_removed']))
+        print("Samples: {}".format(recorder.n_cols))
+
+        # 2. Sample QC: call rate in cases or controls ≥ 0.98
+        print("2. Sample QC: call rate in cases or controls ≥ 0.98")
+        with recorder.stage('2. Sample QC: call rate') as stage:
+            mt, id_cr_filter = stages.run(mt, 'step2', {'mind': mind}, lambda m: qc.filter_sample_cr(m, mind))
+            stage['cols_removed'] = id_cr_filter['sample_miss_cases'] + id_cr_filter['sample_miss_controls']
+        print("Sample QC < 0.98: {}".format(id_cr_filter['sample_miss_cases'] + id_cr_filter['sample_miss_controls']))
+        print("Samples: {}".format(recorder.n_cols))
+
+        # sex is imputed once and shared by steps 3-5 and the F-stat plot
+        def sex_inference(m):
+            imputed, results = qc.impute_sex(m)
+            return dict(results, imputed_sex=imputed)
+
+        with recorder.stage('Sex imputation'):
+            sex_results = stages.results(mt, 'impute_sex', {}, sex_inference)
+            imputed_sex = sex_results['imputed_sex']
+            columnar.write_parquet(imputed_sex.select('is_female', 'f_stat'), metrics_path + 'pre_qc_fstat.parquet')
+            if plots:
+                f_stat_plot = pool.submit(plt.render_fstat, plt.fstat_data(imputed_sex), fhet_y, fhet_x)
+        print("X variants used for sex imputation: {}".format(sex_results['n_x_variants']))
+
+        # 3. Sample QC: F_stats
+        print("3. Sample QC: F_stats")
+        with recorder.stage('3. Sample QC: F_stats') as stage:
+            mt, f_stat_results = stages.run(mt, 'step3', {'fhet_y': fhet_y, 'fhet_x': fhet_x},
+                                            lambda m: qc.filter_sex_check(m, imputed_sex, fhet_y, fhet_x))
+            stage['cols_removed'] = f_stat_results['sex_check_removed']
+        print("Sex check filtered: {}".format(f_stat_results['sex_check_removed']))
+        print("Samples: {}".format(recorder.n_cols))
+
+        # 4. Sample QC: Sex violations (excluded) - genetic sex does not match pedigree sex
+        print("4. Sample QC: Sex violations (excluded) - genetic sex does not match pedigree sex")
+        with recorder.stage('4. Sample QC: Sex violations') as stage:
+            mt, sex_violations = stages.run(mt, 'step4', {'input_type': input_type},
+                                            lambda m: qc.sex_violations(m, imputed_sex, input_type))
+            stage['cols_removed'] = sex_violations['sex_excluded']
+        print("Sex violations: {}".format(sex_violations['sex_excluded']))
+        print("Samples: {}".format(recorder.n_cols))
+
+        # 5. Sample QC: Sex warnings (not excluded) - undefined phenotype / ambiguous genotypes
+        print("# 5. Sample QC: Sex warnings (not excluded) - undefined phenotype / ambiguous genotypes")
+        with recorder.stage('5. Sample QC: Sex warnings'):
+            sex_warnings_count = stages.results(mt, 'step5', {'input_type': input_type},
+                                                lambda m: qc.sex_warnings(m, imputed_sex, input_type))
+        print("Sex warning: {}".format(sex_warnings_count))
+        print("Samples: {}".format(recorder.n_cols))
+
+        # sample removal (steps 2-4) invalidates the variant metrics. Recompute them once, steps 6-11 only filter on
+        # them
+        with recorder.stage('Variant metrics after sample QC'):
+            mt, _ = stages.run(mt, 'sample_qc', {}, lambda m: (qc.compute_variant_metrics(m), {}), sample_boundary=True)
+
+        if variant_shards:
+            # 6-11. SNP QC, sharded by genomic interval and run as concurrent Hail jobs
+            print("# 6-11. SNP QC: {} concurrent shards".format(variant_shards))
+
+            def variant_steps(m):
+                m, results = shards.run_sharded(
+                    m, lambda shard: qc.variant_qc(shard, geno, midi, maf, hwe_th_co, hwe_th_ca, withpna),
+                    variant_shards, checkpoint_dir + basename + '_' if checkpoint_dir else None, shard_bp)
+                # variant removal (steps 6-11) invalidates the per-sample call rates used in the post-QC plots
+                return qc.compute_sample_metrics(m), results
+
+            with recorder.stage('6-11. SNP QC (sharded)') as stage:
+                mt, variant_results = stages.run(mt, 'variant_qc', {'geno': geno, 'midi': midi, 'withpna': withpna,
+                                                                    'maf': maf, 'hwe_th_con': hwe_th_co,
+                                                                    'hwe_th_cas': hwe_th_ca}, variant_steps)
+                stage['rows_removed'] = sum(variant_results.values())
+
+            var_filter = {'geno_removed': variant_results['geno_removed']}
+            midi_results = {'midi_removed': variant_results['midi_removed']}
+            invariant_snps = {'monomorphic_snps': variant_results['monomorphic_snps']}
+            maf_results = {'maf_removed': variant_results['maf_removed']}
+            hwe_con_results = {'maf_removed': variant_results['hwe_con_removed']}
+            hwe_cas_results = {'maf_removed': variant_results['hwe_cas_removed']}
+            print("SNP QC call rate < 0.98: {}".format(var_filter['geno_removed']))
+            print("Missing difference > {}: {}".format(midi, midi_results['midi_removed']))
+            print("Monormorphic SNPs: {}".format(invariant_snps['monomorphic_snps']))
+            print("MAF: {}".format(maf_results['maf_removed']))
+            print("HWE Controls: {}".format(hwe_con_results['maf_removed']))
+            print("HWE Cases: {}".format(hwe_cas_results['maf_removed']))
+        else:
+            # 6. SNP QC: call rate ≥ 0.98
+            print("# 6. SNP QC: call rate ≥ 0.98")
+            with recorder.stage('6. SNP QC: call rate') as stage:
+                mt, var_filter = stages.run(mt, 'step6', {'geno': geno}, lambda m: qc.filter_var_cr(m, geno))
+                stage['rows_removed'] = var_filter['geno_removed']
+            print("SNP QC call rate < 0.98: {}".format(var_filter['geno_removed']))
+            print("Samples: {}".format(recorder.n_cols))
+
+            # 7. SNP QC: missing difference > 0.02
+            print("# 7. SNP QC: missing difference > 0.02")
+            with recorder.stage('7. SNP QC: missing difference') as stage:
+                mt, midi_results = stages.run(mt, 'step7', {'midi': midi}, lambda m: qc.filter_midi(m, midi))
+                stage['rows_removed'] = midi_results['midi_removed']
+            print("Missing difference > {}: {}".format(midi, midi_results['midi_removed']))
+            print("Samples: {}".format(recorder.n_cols))
+
+            # 8. SNP QC: SNPs with no valid association p value are excluded (i.e., invariant SNP)
+            print("# 8. SNP QC: SNPs with no valid association p value are excluded (i.e., invariant SNP)")
+            invariant_snps = {'monomorphic_snps': 0}
+            if withpna == 0:
+                with recorder.stage('8. SNP QC: invariant SNPs') as stage:
+                    mt, invariant_snps = stages.run(mt, 'step8', {}, qc.filter_invariant_snps)
+                    stage['rows_removed'] = invariant_snps['monomorphic_snps']
+                print("Monormorphic SNPs: {}".format(invariant_snps['monomorphic_snps']))
+                print("Samples: {}".format(recorder.n_cols))
+
+            # 9. SNP QC: with MAF ≥ 0.01
+            print("# 9. SNP QC: with MAF ≥ 0.01")
+            with recorder.stage('9. SNP QC: MAF') as stage:
+                mt, maf_results = stages.run(mt, 'step9', {'maf': maf}, lambda m: qc.filter_maf(m, maf))
+                stage['rows_removed'] = maf_results['maf_removed']
+            print("MAF: {}".format(maf_results['maf_removed']))
+            print("Samples: {}".format(recorder.n_cols))
+
+            # 10. SNP QC: Hardy-Weinberg equilibrium (HWE) in controls p value ≥ 1e-06
+            print("# 10. SNP QC: Hardy-Weinberg equilibrium (HWE) in controls p value ≥ 1e-06")
+            with recorder.stage('10. SNP QC: HWE controls') as stage:
+                mt, hwe_con_results = stages.run(mt, 'step10', {'hwe_th_con': hwe_th_co},
+                                                 lambda m: qc.filter_hwe(m, 'Control', hwe_th_co))
+                stage['rows_removed'] = hwe_con_results['maf_removed']
+            print("HWE Controls: {}".format(hwe_con_results['maf_removed']))
+            print("Samples: {}".format(recorder.n_cols))
+
+            # 11. SNP QC: Hardy-Weinberg equilibrium (HWE) in cases p value ≥ 1e-10
+            print("# 11. SNP QC: Hardy-Weinberg equilibrium (HWE) in cases p value ≥ 1e-10")
+
+            def step11(m):
+                m, results = qc.filter_hwe(m, 'Case', hwe_th_ca)
+                # variant removal (steps 6-11) invalidates the per-sample call rates used in the post-QC plots
+                return qc.compute_sample_metrics(m), results
+
+            with recorder.stage('11. SNP QC: HWE cases') as stage:
+                mt, hwe_cas_results = stages.run(mt, 'step11', {'hwe_th_cas': hwe_th_ca}, step11)
+                stage['rows_removed'] = hwe_cas_results['maf_removed']
+            print("HWE Cases: {}".format(hwe_cas_results['maf_removed']))
+            print("Samples: {}".format(recorder.n_cols))
+
+        # Post-qc counts
+        with recorder.stage('post-QC counts'):
+            post_qc_counts = stages.results(mt, 'post_qc_counts', {}, qc.collect_counts)
+
+        # Post-QC metrics and plots
+        print("Exporting post-QC metrics")
+        with recorder.stage('post-QC metrics export'):
+            pos_plots = export_metrics(mt, 'post_qc')
+
+        # Tables
+        filter_counts_list = [var_pre_filter['geno_removed'], id_cr_filter['sample_miss_cases'] + id_cr_filter['sample_miss_controls'],
+                              f_stat_results['sex_check_removed'], sex_violations['sex_excluded'], sex_warnings_count,
+                              var_filter['geno_removed'], midi_results['midi_removed'],
+                              invariant_snps['monomorphic_snps'],
+                              hwe_con_results['maf_removed'], hwe_cas_results['maf_removed']]
+        size_of_sample_html, exlusion_overview_html = generate_tables(pre_qc_counts, post_qc_counts, filter_counts_list)
+
+        outplink = dirname + basename + '_qc{}'.format(qc_round)
+        with recorder.stage('PLINK export'):
+            hl.export_plink(qc.included(mt), outplink)
+
+        with recorder.stage('Exclusion tables'):
+            qc.write_exclusions(mt, dirname, basename)
+
+        # the export above overlapped with the post-QC rendering, collect the plots
+        qc_plots_list = None
+        if plots:
+            with recorder.stage('plot rendering'):
+                qc_plots_list = plt.collect_plots(pre_plots, pos_plots, f_stat_plot)
+
+        params = {'dirname': dirname, 'basename': basename, 'input_type': input_type, 'pre_geno': pre_geno,
+                  'mind': mind, 'fhet_y': fhet_y, 'fhet_x': fhet_x, 'geno': geno, 'midi': midi, 'maf': maf,
+                  'hwe_th_con': hwe_th_co, 'hwe_th_cas': hwe_th_ca, 'qc_round': qc_round, 'withpna': withpna,
+                  'checkpoint_dir': checkpoint_dir, 'checkpoint_policy': checkpoint_policy, 'association': association,
+                  'plot_workers': plot_workers, 'input_key': input_key, 'resume': resume,
+                  'variant_shards': variant_shards, 'shard_bp': shard_bp, 'plots': plots}
+        # everything --report_only needs besides the Parquet metrics
+        report = {'pre_qc_counts': pre_qc_counts, 'post_qc_counts': post_qc_counts, 'filter_counts': filter_counts_list,
+                  'reference': plt.reference_lengths(mt.locus.dtype.reference_genome),
+                  # written last, so a manifest with metrics means the Parquet files are those of this run
+                  'metrics': {'stages': columnar.STAGES, 'association': metrics_association}}
+        recorder.write_manifest(dirname + basename + '_run_manifest.json', params, report)
+
+        timings_html = recorder.to_html() if report_timings else None
+        qc_tables_list = [size_of_sample_html, exlusion_overview_html, timings_html]
+
+        return qc_tables_list, qc_plots_list
+    finally:
+        # also stops the rendering processes when a step fails, e.g. a failed cohort of a batch
+        if pool is not None:
+            pool.shutdown()
+
@@ -0,0 +1,112 @@
+import json
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
+
+import hail as hl
+
+
+def _spark_context():
+    # the Spark backend is the only one with a status tracker, other backends are timed but not profiled
+    try:
+        return hl.spark_context()
+    except Exception:
+        return None
+
+
+def _job_ids(sc, job_group: str = None) -> Set[int]:
+    # jobs of the job group of the run (batch cohorts each set their own), or the ungrouped jobs
+    if sc is None:
+        return set()
+    return set(sc.statusTracker().getJobIdsForGroup(job_group))
+
+
+def _stage_input_bytes(sc, stage_ids: List[int]) -> Optional[int]:
+    """
+    Sum the input bytes of the given Spark stages using the Spark UI REST API. Returns None if the UI is disabled
+    """
+    if sc is None or not sc.uiWebUrl:
+        return None
+
+    import urllib.request
+    n_bytes = 0
+    try:
+        for stage_id in stage_ids:
+            url = '{}/api/v1/applications/{}/stages/{}'.format(sc.uiWebUrl, sc.applicationId, stage_id)
+            with urllib.request.urlopen(url, timeout=5) as response:
+                attempts = json.loads(response.read().decode('utf-8'))
+            n_bytes += sum(attempt.get('inputBytes', 0) for attempt in attempts)
+    except Exception:
+        return None
+
+    return n_bytes
+
+
+class RunRecorder:
+    """
+    Records wall time, Spark jobs/stages, bytes read and rows/columns in and out for every numbered step of run_qc.
+    Row and column counts are tracked from the counts each step already returns, no extra jobs are run
+    """
+
+    def __init__(self, n_rows: int = None, n_cols: int = None):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.stages: List[Dict] = []
+        self.start = time.time()
+        self._sc = _spark_context()
+        # the job group is a thread-local Spark property, read in the thread that runs the stages
+        self._job_group = self._sc.getLocalProperty('spark.jobGroup.id') if self._sc is not None else None
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a step. The step sets 'rows_removed' and/or 'cols_removed' on the yielded dict
+        :param name: step name
+        """
+        record = {'stage': name, 'rows_in': self.n_rows, 'cols_in': self.n_cols, 'rows_removed': 0,
+                  'cols_removed': 0}
+        jobs_before = _job_ids(self._sc, self._job_group)
+        start = time.perf_counter()
+
+        yield record
+
+        record['wall_time_s'] = round(time.perf_counter() - start, 3)
+        new_jobs = sorted(_job_ids(self._sc, self._job_group) - jobs_before)
+        stage_ids = []
+        for job_id in new_jobs:
+            job_info = self._sc.statusTracker().getJobInfo(job_id)
+            if job_info is not None:
+                stage_ids.extend(job_info.stageIds)
+        record['spark_jobs'] = len(new_jobs)
+        record['spark_stages'] = len(stage_ids)
+        record['bytes_read'] = _stage_input_bytes(self._sc, stage_ids)
+
+        if self.n_rows is not None:
+            self.n_rows -= record['rows_removed']
+            self.n_cols -= record['cols_removed']
+        record['rows_out'] = self.n_rows
+        record['cols_out'] = self.n_cols
+        self.stages.append(record)
+
+    def write_manifest(self, path: str, params: Dict, report: Dict = None):
+        """
+        Write the run manifest (parameters, per-stage records and total wall time) as JSON
+        :param path: output path
+        :param params: run parameters
+        :param report: report tables data (counts, filter counts, reference genome), read back by --report_only
+        """
+        manifest = {
+            'params': params,
+            'hail_version': hl.version(),
+            'total_wall_time_s': round(time.time() - self.start, 3),
+            'stages': self.stages
+        }
+        if report is not None:
+            manifest['report'] = report
+        with hl.hadoop_open(path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    def to_html(self) -> str:
+        from preimp_qc.report import timings_html
+
+        return timings_html(self.stages)
@@ -1,23 +1,44 @@
+from typing import List
+
 import hail as hl
 
 
-def read_plink(dirname: str, basename: str, reference: str = 'GRCh38') -> hl.MatrixTable:
-    hl.init(default_reference=reference)
+def read_plink(dirname: str, basename: str, reference: str = 'GRCh38', min_partitions: int = None) -> hl.MatrixTable:
     mt: hl.MatrixTable = hl.import_plink(bed=dirname + basename + '.bed',
                                          bim=dirname + basename + '.bim',
-                                         fam=dirname + basename + '.fam')
+                                         fam=dirname + basename + '.fam',
+                                         reference_genome=reference,
+                                         min_partitions=min_partitions)
     return mt
 
 
-def read_vcf(dirname: str, vcf: str, annotations: str) -> hl.MatrixTable:
-    hl.import_vcf(vcf).write('{}preimpQC.mt'.format(dirname), overwrite=True)
-    mt = hl.read_matrix_table('{}preimpQC.mt'.format(dirname))
+# reported sex codes recognised in the annotations file, anything else (including missing) is unreported
+FEMALE_CODES = {'F': True, 'FEMALE': True, '2': True, 'M': False, 'MALE': False, '1': False}
+
+
+def read_vcf(dirname: str, vcf: str, annotations: str, reference: str = 'GRCh38', min_partitions: int = None,
+             block_size: int = None, force_bgz: bool = False, write_native: bool = False) -> hl.MatrixTable:
+    """
+    :param dirname: output directory, used for the native copy
+    :param vcf: path to the VCF
+    :param annotations: tab-delimited sample annotations with Sample and Sex columns
+    :param reference: reference genome
+    :param min_partitions: minimum number of partitions to import the VCF into
+    :param block_size: block size of the import in MB
+    :param force_bgz: read .gz files as blocked gzip so they can be split across partitions
+    :param write_native: write a native copy of the VCF and read it back. Otherwise the VCF is streamed into QC,
+    which is cheaper unless the pipeline is not checkpointed and reads the input several times
+    :return: Hail MatrixTable
+    """
+    mt = hl.import_vcf(vcf, reference_genome=reference, force_bgz=force_bgz, min_partitions=min_partitions,
+                       block_size=block_size)
+    if write_native:
+        mt = mt.checkpoint('{}preimpQC.mt'.format(dirname), overwrite=True)
+
+    # recode reported sex to True/False on the (small) annotations table before joining it to the columns
     ann = hl.import_table(annotations, impute=True).key_by('Sample')
+    ann = ann.annotate(Sex=hl.literal(FEMALE_CODES).get(hl.str(ann.Sex).upper()))
     mt = mt.annotate_cols(annotations=ann[mt.s])
-    # need to change reported sex to True/False, can update how this is done later, ideally don't want to hardcode
-    # this will not work for unreported sex but will work for missing values
-    mt = mt.annotate_cols(annotations=mt.annotate(Sex=hl.if_else((mt.annotations.Sex == 'F' | mt.annotations.Sex == 2 |
-                                                                  mt.annotations.Sex == 'Female'), True, False)))
     # add a check to make sure file is formatted as we'd expect else quit and throw error
     return mt
 
@@ -25,3 +46,86 @@ def read_vcf(dirname: str, vcf: str, annotations: str) -> hl.MatrixTable:
 def read_mt(dirname: str, basename: str) -> hl.MatrixTable:
     mt: hl.MatrixTable = hl.read_matrix_table(dirname + basename + ".mt")
     return mt
+
+
+# PLINK-style sample and variant lists, applied right after the import
+FILTER_LISTS = ['keep', 'remove', 'extract', 'exclude', 'extract_range', 'exclude_range']
+
+
+def read_sample_list(path: str) -> hl.Table:
+    """
+    :param path: whitespace-delimited sample list without header, FID IID (PLINK --keep/--remove) or one ID per line
+    :return: Hail Table keyed by s (the IID)
+    """
+    ht = hl.import_table(path, no_header=True, delimiter=r'\s+')
+    sample_field = 'f1' if 'f1' in ht.row else 'f0'
+
+    return ht.key_by(s=ht[sample_field]).select()
+
+
+def read_variant_list(path: str) -> hl.Table:
+    """
+    :param path: variant IDs (rsids), one per line (PLINK --extract/--exclude)
+    :return: Hail Table keyed by rsid
+    """
+    ht = hl.import_table(path, no_header=True, delimiter=r'\s+')
+
+    return ht.key_by(rsid=ht.f0).select().distinct()
+
+
+def read_range_list(path: str, reference: str = 'GRCh38') -> List[hl.expr.IntervalExpression]:
+    """
+    :param path: whitespace-delimited ranges without header, chr start end [label] with 1-based inclusive positions
+    (PLINK --extract/--exclude range)
+    :param reference: reference genome, contig names are converted to its naming (chr prefix or not)
+    :return: list of locus intervals for hl.filter_intervals
+    """
+    rg = hl.get_reference(reference)
+    intervals = []
+    with hl.hadoop_open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            contig = fields[0]
+            if contig not in rg.contigs:
+                contig = contig[3:] if contig.startswith('chr') else 'chr' + contig
+            intervals.append(hl.locus_interval(contig, int(fields[1]), int(fields[2]), includes_end=True,
+                                               reference_genome=rg))
+
+    return intervals
+
+
+def filter_input(mt: hl.MatrixTable, reference: str = 'GRCh38', keep: str = None, remove: str = None,
+                 extract: str = None, exclude: str = None, extract_range: str = None,
+                 exclude_range: str = None) -> hl.MatrixTable:
+    """
+    Apply the sample and variant lists before any QC pass. Ranges are applied with hl.filter_intervals, which is pushed
+    down into the reader so excluded regions are never read. Sample and variant lists are semi/anti-joins with keyed
+    tables
+    :param mt: Hail MatrixTable as returned by the readers
+    :param reference: reference genome
+    :param keep: keep only the samples in this list
+    :param remove: remove the samples in this list
+    :param extract: keep only the variants (rsids) in this list
+    :param exclude: remove the variants (rsids) in this list
+    :param extract_range: keep only the variants in these ranges
+    :param exclude_range: remove the variants in these ranges
+    :return: filtered Hail MatrixTable
+    """
+    if extract_range:
+        mt = hl.filter_intervals(mt, read_range_list(extract_range, reference), keep=True)
+    if exclude_range:
+        mt = hl.filter_intervals(mt, read_range_list(exclude_range, reference), keep=False)
+
+    if keep:
+        mt = mt.semi_join_cols(read_sample_list(keep))
+    if remove:
+        mt = mt.anti_join_cols(read_sample_list(remove))
+
+    if extract:
+        mt = mt.filter_rows(hl.is_defined(read_variant_list(extract)[mt.rsid]))
+    if exclude:
+        mt = mt.filter_rows(hl.is_missing(read_variant_list(exclude)[mt.rsid]))
+
+    return mt
@@ -0,0 +1,11 @@
+# choices of the command line options. This module must stay free of Hail, pandas and plotting imports so the
+# parser (and --help) builds without loading them
+
+# where run_qc cuts the lazy pipeline, see stages.checkpoint_stage
+CHECKPOINT_POLICIES = ['none', 'samples', 'stages']
+
+# association test of the Manhattan/QQ plots, see test_plots.man_qq_data
+ASSOCIATION_MODES = ['regression', 'allelic']
+
+# html: full report with plots, none: no plots and no HTML report (tables, exclusion tables and PLINK export only)
+REPORT_MODES = ['html', 'none']
@@ -2,18 +2,18 @@
 
 import argparse
 
-from preimp_qc.functions import run_qc
-from preimp_qc.io import read_plink, read_vcf, read_mt
-from preimp_qc.report import write_html_report
+# only light modules are imported here, Hail and the pipeline are imported by run() once the arguments are parsed
+from preimp_qc.engine import add_engine_arguments, init_engine
+from preimp_qc.options import ASSOCIATION_MODES, CHECKPOINT_POLICIES, REPORT_MODES
+from preimp_qc.report import REPORT_ASSET_MODES
 
 
-
-def main():
-    parser = argparse.ArgumentParser()
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='preimp_qc V1.0')
     parser.add_argument('--dirname', type=str, required=True)
     parser.add_argument('--basename', type=str, required=True)
     parser.add_argument('--input_type', type=str, required=True, choices=['vcf', 'plink', 'hail'])
+    parser.add_argument('--vcf', type=str, help="path to the VCF (ONLY for VCF input)")
     parser.add_argument('--annotations', type=str)
     parser.add_argument('--reference', type=str, default='GRCh38')
     parser.add_argument('--qc_round', type=str, required=True)
@@ -34,28 +34,194 @@ def main():
     parser.add_argument('--hwe_th_con', type=float, default=1e-6, help="HWE_controls < NUM")
     parser.add_argument('--hwe_th_cas', type=float, default=1e-6, help="HWE_cases < NUM")
 
-    arg = parser.parse_args()
+    parser.add_argument('--association', type=str, default='regression', choices=ASSOCIATION_MODES,
+                        help="association test for the Manhattan/QQ plots: regression (linear regression on dosage) "
+                             "or allelic (allelic chi-squared test from the QC genotype counts, no extra pass)")
+
+    # sample and variant lists, applied before any QC pass
+    parser.add_argument('--keep', type=str, help="keep only the samples in this file (FID IID, or one ID per line)")
+    parser.add_argument('--remove', type=str, help="remove the samples in this file (FID IID, or one ID per line)")
+    parser.add_argument('--extract', type=str, help="keep only the variants (rsids) in this file")
+    parser.add_argument('--exclude', type=str, help="remove the variants (rsids) in this file")
+    parser.add_argument('--extract_range', type=str,
+                        help="keep only the variants in the ranges of this file (chr start end [label])")
+    parser.add_argument('--exclude_range', type=str,
+                        help="remove the variants in the ranges of this file (chr start end [label])")
+
+    # threshold sweep. Each grid defaults to the single threshold above
+    parser.add_argument('--sweep', action='store_true',
+                        help="instead of running QC, report the samples and SNPs removed by every combination of the "
+                             "threshold grids, from a single metrics pass")
+    parser.add_argument('--sweep_geno', type=float, nargs='+', help="--geno values to sweep")
+    parser.add_argument('--sweep_midi', type=float, nargs='+', help="--midi values to sweep")
+    parser.add_argument('--sweep_mind', type=float, nargs='+', help="--mind values to sweep")
+    parser.add_argument('--sweep_maf', type=float, nargs='+', help="--maf values to sweep")
+    parser.add_argument('--sweep_hwe_con', type=float, nargs='+', help="--hwe_th_con values to sweep")
+    parser.add_argument('--sweep_hwe_cas', type=float, nargs='+', help="--hwe_th_cas values to sweep")
+
+    # execution profile
+    add_engine_arguments(parser)
+
+    # ingestion
+    parser.add_argument('--min_partitions', type=int,
+                        help="minimum number of partitions to import the PLINK/VCF input into, overrides the profile")
+    parser.add_argument('--block_size', type=int, help="block size of the VCF import in MB")
+    parser.add_argument('--force_bgz', action='store_true',
+                        help="read a .gz VCF as blocked gzip so it can be split across partitions")
+    parser.add_argument('--write_native', action='store_true',
+                        help="write a native copy of the VCF before QC instead of streaming it into QC")
+
+    # conversion cache
+    parser.add_argument('--cache_dir', type=str,
+                        help="directory of the converted input cache, defaults to <dirname>preimp_qc_cache/")
+    parser.add_argument('--cache_max_gb', type=float, default=50,
+                        help="size limit of the converted input cache, least recently used inputs are evicted")
+    parser.add_argument('--cache_hash', action='store_true',
+                        help="also hash the input file contents for the cache key (default: size and mtime)")
+    parser.add_argument('--no_cache', action='store_true', help="always re-import the raw input")
+
+    # execution
+    parser.add_argument('--checkpoint_dir', type=str,
+                        help="directory for native MatrixTable checkpoints between stages. If not set, stages are "
+                             "persisted in memory (only for small datasets)")
+    parser.add_argument('--checkpoint_policy', type=str, choices=CHECKPOINT_POLICIES,
+                        help="where to cut the pipeline: none, samples (after the sample filters) or stages (after "
+                             "every stage). Defaults to samples with --checkpoint_dir, none otherwise")
+    parser.add_argument('--resume', action='store_true',
+                        help="store every stage under a key of its input and parameters (in --checkpoint_dir, or "
+                             "<dirname>preimp_qc_stages/) and reuse the unchanged stages of a previous run. Changing "
+                             "a threshold only reruns the stages from that step on")
+
+    parser.add_argument('--variant_shards', type=int, default=0,
+                        help="run the variant-only steps 6-11 on genomic shards with this many concurrent Hail jobs")
+    parser.add_argument('--shard_bp', type=int,
+                        help="length of the variant QC shards in bp, one shard per contig if not set")
+    parser.add_argument('--plot_workers', type=int,
+                        help="number of processes rendering the plots, defaults to the number of cores")
+    parser.add_argument('--report', type=str, default='html', choices=REPORT_MODES,
+                        help="html: HTML report with plots. none: no plots and no HTML report, only the tables, "
+                             "exclusion tables and PLINK export (quick reruns, batch jobs)")
+    parser.add_argument('--no_plots', action='store_true',
+                        help="skip every plot and the association regression, the HTML report only has the tables")
+    parser.add_argument('--report_assets', type=str, default='inline', choices=REPORT_ASSET_MODES,
+                        help="inline: self-contained HTML report with base64 figures. files: figures are written "
+                             "to report_assets/ next to the report and lazy-loaded")
+    parser.add_argument('--report_timings', action='store_true',
+                        help="add a per-stage timing table to the HTML report")
+    parser.add_argument('--report_only', action='store_true',
+                        help="rebuild the HTML report of a previous run from its run manifest and Parquet QC metrics "
+                             "(<dirname><basename>_qc_metrics/), without Hail or Spark. The threshold lines of the "
+                             "plots are those of the run, --mind, --geno, --fhet_y and --fhet_x given explicitly move "
+                             "them")
+
+    return parser
+
+
+def run(arg: argparse.Namespace, partition_target: int = None):
+    """
+    Run QC (or the threshold sweep) for one dataset in the current Hail session
+    :param arg: parsed preimp_qc arguments
+    :param partition_target: number of partitions for the imports from the execution profile, --min_partitions wins
+    """
+    from preimp_qc.cache import cached_input, file_fingerprint, input_key
+    from preimp_qc.functions import run_qc
+    from preimp_qc.io import read_plink, read_vcf, read_mt, filter_input, FILTER_LISTS
+    from preimp_qc.report import write_html_report, write_sweep_report
+    from preimp_qc.sweep import sweep_thresholds, write_sweep
+
+    min_partitions = arg.min_partitions if arg.min_partitions else partition_target
+
+    # sample and variant lists are applied right after the import, so the cache holds the filtered input
+    filter_lists = {name: getattr(arg, name) for name in FILTER_LISTS if getattr(arg, name)}
+
+    def apply_filter_lists(mt):
+        return filter_input(mt, arg.reference, **filter_lists)
 
-    # read input
+    # read input. PLINK and VCF inputs are converted once and reused from the cache across runs
     if arg.input_type == 'plink':
-        input_mt = read_plink(arg.dirname, arg.basename, arg.reference)
+        input_paths = [arg.dirname + arg.basename + ext for ext in ['.bed', '.bim', '.fam']]
+        import_options = {}
+
+        def convert():
+            return apply_filter_lists(read_plink(arg.dirname, arg.basename, arg.reference, min_partitions))
 
     if arg.input_type == 'vcf':
-        input_mt = read_vcf(arg.dirname, arg.vcf, arg.annotations)
+        input_paths = [arg.vcf]
+        import_options = {'force_bgz': arg.force_bgz, 'min_partitions': arg.min_partitions,
+                          'block_size': arg.block_size}
+
+        def convert():
+            return apply_filter_lists(read_vcf(arg.dirname, arg.vcf, arg.annotations, arg.reference,
+                                               min_partitions, arg.block_size, arg.force_bgz, arg.write_native))
+
+    if arg.input_type == 'hail':
+        input_paths = [arg.dirname + arg.basename + '.mt/metadata.json.gz']
+        import_options = {}
 
+    # the lists change the converted input, their fingerprints are part of the input key
+    import_options['filter_lists'] = {name: file_fingerprint(path, arg.cache_hash)
+                                      for name, path in filter_lists.items()}
+
+    # the input key addresses the converted input in the cache and is the root of the stage keys of --resume
+    key = input_key(input_paths, arg.reference, arg.annotations, arg.cache_hash, import_options)
+
+    metrics_computed = False
     if arg.input_type == 'hail':
-        input_mt = read_mt(arg.dirname, arg.basename)
+        input_mt = apply_filter_lists(read_mt(arg.dirname, arg.basename))
+    elif arg.no_cache:
+        input_mt = convert()
+    else:
+        cache_dir = arg.cache_dir if arg.cache_dir else arg.dirname + 'preimp_qc_cache/'
+        input_mt = cached_input(cache_dir, key, convert, arg.cache_max_gb)
+        metrics_computed = True
+
+    if arg.sweep:
+        print("Running threshold sweep")
+        sweep = sweep_thresholds(input_mt, arg.pre_geno, arg.sweep_geno or [arg.geno], arg.sweep_midi or [arg.midi],
+                                 arg.sweep_mind or [arg.mind], arg.sweep_maf or [arg.maf],
+                                 arg.sweep_hwe_con or [arg.hwe_th_con], arg.sweep_hwe_cas or [arg.hwe_th_cas],
+                                 arg.withpna, metrics_computed)
+        write_sweep_report(arg.dirname, arg.basename, write_sweep(sweep, arg.dirname, arg.basename))
+        print("\nDone running threshold sweep!")
+        return
 
     print("Running QC")
     qc_tables, qc_plots = run_qc(input_mt, arg.dirname, arg.basename, arg.input_type, arg.pre_geno, arg.mind, arg.fhet_y,
                                  arg.fhet_x, arg.geno, arg.midi, arg.maf, arg.hwe_th_con, arg.hwe_th_cas, arg.qc_round,
-                                 arg.withpna,)
+                                 arg.withpna, arg.checkpoint_dir, arg.checkpoint_policy,
+                                 arg.report_timings, arg.association, arg.plot_workers, metrics_computed, key,
+                                 arg.resume, arg.variant_shards, arg.shard_bp,
+                                 plots=not arg.no_plots and arg.report != 'none')
 
-    print("Generating report")
-    write_html_report(arg.dirname, arg.basename, qc_tables, qc_plots)
+    if arg.report != 'none':
+        print("Generating report")
+        write_html_report(arg.dirname, arg.basename, qc_tables, qc_plots, arg.report_assets)
 
     print("\nDone running QC!")
 
 
+def main():
+    parser = build_parser()
+    arg = parser.parse_args()
+
+    if arg.report_only:
+        from preimp_qc.columnar import rebuild_report
+
+        # the threshold lines default to the thresholds of the run (from its manifest), only the flags given override
+        parser.set_defaults(mind=None, geno=None, fhet_y=None, fhet_x=None)
+        thresholds = parser.parse_args()
+
+        print("Rebuilding report")
+        rebuild_report(arg.dirname, arg.basename, thresholds.mind, thresholds.geno, thresholds.fhet_y,
+                       thresholds.fhet_x, arg.report_assets, arg.report_timings, arg.plot_workers)
+        print("\nDone rebuilding the report!")
+        return
+
+    partition_target = init_engine(arg.profile, arg.reference, arg.cores, arg.driver_memory, arg.tmp_dir, arg.log,
+                                   arg.spark_conf)
+
+    run(arg, partition_target)
+
+
 if __name__ == '__main__':
     main()
@@ -1,14 +1,129 @@
-def write_html_report(dirname, basename, qc_tables_list, qc_plots_list):
+import base64
+import os
+
+REPORT_ASSET_MODES = ['inline', 'files']
+
+# file names of the report figures, in qc_plots_list order
+PLOT_NAMES = ['manhattan_qq_pre_qc', 'manhattan_qq_post_qc', 'sample_call_rate_controls_pre_qc',
+              'sample_call_rate_cases_pre_qc', 'sample_call_rate_controls_post_qc', 'sample_call_rate_cases_post_qc',
+              'fstat_pre_qc', 'variant_call_rate_controls_pre_qc', 'variant_call_rate_cases_pre_qc',
+              'variant_call_rate_controls_post_qc', 'variant_call_rate_cases_post_qc']
+
+MIME_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'svg': 'image/svg+xml'}
+
+
+def image_html(image, name, assets_dir=None):
+    """
+    :param image: dict with the image format and bytes, as returned by the test_plots renderers
+    :param name: file name (without extension) used in files mode
+    :param assets_dir: if set, the image is written there and referenced with a lazy-loading img tag, otherwise it
+    is inlined as base64
+    :return: img tag
+    """
+    if assets_dir is None:
+        data = base64.b64encode(image['data']).decode('ascii')
+        return '<img src="data:{};base64,{}">'.format(MIME_TYPES[image['format']], data)
+
+    filename = '{}.{}'.format(name, image['format'])
+    with open(os.path.join(assets_dir, filename), 'wb') as f:
+        f.write(image['data'])
+
+    return '<img src="{}/{}" loading="lazy" alt="{}">'.format(os.path.basename(os.path.normpath(assets_dir)),
+                                                             filename, name)
+
+
+def two_plots_html(left, right):
+    return '''
+      <div class="outer-container">
+        <div>
+          ''' + left + '''
+        </div>
+        <div>
+          ''' + right + '''
+        </div>
+      </div>
+      '''
+
+
+def generate_tables(pre_qc_counts, post_qc_counts, filter_counts):
+    import pandas as pd
+    # this function is for generating the tables in the Generak Info section
+    # HAVE TO WORK ON FLAGS TABLE
+
+    # Size of Sample table
+    pre_qc_pheno_counts = [pre_qc_counts[3], pre_qc_counts[4], pre_qc_counts[5]]
+    post_qc_pheno_counts = [post_qc_counts[3], post_qc_counts[4], post_qc_counts[5]]
+    ex_pheno = [x1 - x2 for x1, x2 in zip(pre_qc_pheno_counts, post_qc_pheno_counts)]
+    pre_qc_sex_counts = [pre_qc_counts[0], pre_qc_counts[1], pre_qc_counts[2]]
+    post_qc_sex_counts = [post_qc_counts[0], post_qc_counts[1], post_qc_counts[2]]
+    ex_sex = [x1 - x2 for x1, x2 in zip(pre_qc_sex_counts, post_qc_sex_counts)]
+    n_snps_pre = pre_qc_counts[6]
+    n_snps_post = post_qc_counts[6]
+    ex_snps = n_snps_pre - n_snps_post
+    size_of_sample = [['Cases,Controls,Missing', pre_qc_pheno_counts, post_qc_pheno_counts, ex_pheno],
+                      ['Males,Females,Unspec', pre_qc_sex_counts, post_qc_sex_counts, ex_sex],
+                      ['SNPs', n_snps_pre, n_snps_post, ex_snps]]
+    size_of_sampledf = pd.DataFrame(size_of_sample, columns=['Test', 'pre QC', 'post QC', 'exclusion-N'])
+    size_of_sample_html = size_of_sampledf.to_html()
+
+    # Exlusion overview table
+    snps_cr_95 = ['SNPs: call rate < 0.950 (pre-filter)', filter_counts[0]]
+    ids_cr = ['IDS: call rate (cases/controls) < 0.980', filter_counts[1]]
+    ids_fhet = ['IDs: FHET outside +- 0.20 (cases/controls)', filter_counts[2]]
+    ids_sex_violations = ['IDs: Sex violations -excluded- (N-tested)', filter_counts[3]]
+    ids_sex_warnings = ['IDs: Sex warnings (undefined genotype/ambigous genotype)', filter_counts[4]]
+    snps_cr_98 = ['SNPs: call rate < 0.980', filter_counts[5]]
+    snps_midi = ['SNPs: missing-rate difference (cases/controls) > 0.020', filter_counts[6]]
+    snps_monomorphic = ['SNPs: without valid association p-value (invariant)', filter_counts[7]]
+    snps_hwe_con = ['SNPs: HWE-controls < -6', filter_counts[8]]
+    snps_hwe_cas = ['SNPs: HWE-cases < -10', filter_counts[9]]
+    exlusion_overview = [snps_cr_95, ids_cr, ids_fhet, ids_sex_violations, ids_sex_warnings, snps_cr_98, snps_midi,
+                         snps_monomorphic, snps_hwe_con, snps_hwe_cas]
+    exlusion_overviewdf = pd.DataFrame(exlusion_overview, columns=['Filter', 'N'])
+    exlusion_overview_html = exlusion_overviewdf.to_html()
+
+    return size_of_sample_html, exlusion_overview_html
+
+
+# columns of the run manifest stages shown in the timing table
+TIMING_COLUMNS = ['stage', 'wall_time_s', 'spark_jobs', 'spark_stages', 'bytes_read', 'rows_in', 'rows_out', 'cols_in',
+                  'cols_out']
+
+
+def timings_html(stages):
+    """
+    :param stages: per-stage records of the run manifest (RunRecorder.stages)
+    :return: HTML timing table
+    """
+    import pandas as pd
+
+    return pd.DataFrame(stages, columns=TIMING_COLUMNS).to_html()
+
+
+def write_html_report(dirname, basename, qc_tables_list, qc_plots_list, asset_mode='inline'):
+    """
+    Write the report section by section to dirname/report.html
+    :param dirname: output directory
+    :param basename: data basename
+    :param qc_tables_list: [size of sample, exclusion overview, optional timings] HTML tables
+    :param qc_plots_list: images in PLOT_NAMES order, None if the run had no plots
+    :param asset_mode: inline (one self-contained HTML file) or files (figures written to report_assets/ and
+    lazy-loaded)
+    """
 
     # create a complete HTML file
     from datetime import date
     today = date.today()
     date = today.strftime("%B %d, %Y")
 
-    # get plot files
-    # pre_man_plt, pre_qq_plt = dirname + 'ManpreQC.png', dirname + 'QQplotpreQC.png'
-    # pre_var_cas, pre_var_con = dirname + 'casSNPcrpreQC.png', dirname + 'conSNPcrpreQC.png'
-    # pre_id_cas, pre_id_con = dirname + 'casIDcrpreQC.png', dirname + 'conIDPcrpreQC.png'
+    assets_dir = None
+    if asset_mode == 'files':
+        assets_dir = dirname + 'report_assets'
+        os.makedirs(assets_dir, exist_ok=True)
+
+    # images are encoded or written one at a time, while the page is streamed
+    def plot(i):
+        return image_html(qc_plots_list[i], PLOT_NAMES[i], assets_dir)
 
     abstract = '''This is an automatic output of the QC-Step of the preimp-QC-pipeline, created at MGH, December 2010. It is now in version
     <br/>0.1.0. It is supposed to check and clean a GWAS dataset for technical problems and/or uncontrollable population stratification.
@@ -16,12 +131,7 @@ def write_html_report(dirname, basename, qc_tables_list, qc_plots_list):
     <br />requests, feel free to write me.
     '''
 
-    # qc_plots_list = [pre_man_qq_base64, pos_man_qq_base64, pre_con_id_base64, pre_cas_id_base64, pos_con_id_base64, pos_cas_id_base64,
-    #                      f_stat_plot, pre_con_var_base64, pre_cas_var_base64, pos_con_var_base64, pos_cas_var_base64]
-
-    # qc_tables_list = [size_of_sample_html, exlusion_overview_html]
-
-    text = '''
+    header = '''
     <!doctype html>
 
     <html lang="en">
@@ -74,69 +184,93 @@ def write_html_report(dirname, basename, qc_tables_list, qc_plots_list):
 
       <h2>1 Flags</h2>
       <h2>1 There should be a table here. It's coming...</h2>
+    '''
+
+    outhtml = dirname + 'report.html'
+    with open(outhtml, "w") as file:
+        file.write(header)
 
+        file.write('''
       <h2>2 General Info</h2>
       <h3>2.1 Size of sample General Info</h3>
       ''' + qc_tables_list[0] + '''
       <h3>2.2 Exclusion overview</h3>
       ''' + qc_tables_list[1] + '''
+    ''')
 
+        if qc_plots_list is None:
+            file.write('''
+      <p>Plots were not generated for this run (--no_plots).</p>
+    ''')
+        else:
+            file.write('''
       <h2>3 Manhattan</h2>
       <h3>3.1 Manhattan-Plot - pre-QC</h2>
-      ''' + qc_plots_list[0] + '''
+      ''' + plot(0) + '''
+    ''')
+            file.write('''
       <h3>3.2 Manhattan-Plot - post-QC</h2>
-      ''' + qc_plots_list[1] + '''
+      ''' + plot(1) + '''
+    ''')
 
+            file.write('''
       <h2>4. Per Individual Characteristics Analysis</h2>
-      <h3>4.1. Missing Rates - pre-QC</h3>
-      <div class="outer-container">
-        <div>
-          ''' + qc_plots_list[2] + '''
-        </div>
-        <div>
-          ''' + qc_plots_list[3] + '''
-        </div>
-      </div>
-      
-      <h3>4.2. Missing Rates - post-QC</h3>
-      <div class="outer-container">
-        <div>
-          ''' + qc_plots_list[4] + '''
-        </div>
-        <div>
-          ''' + qc_plots_list[5] + '''
-        </div>
-      </div>
-      
+      <h3>4.1. Missing Rates - pre-QC</h3>''' + two_plots_html(plot(2), plot(3)))
+            file.write('''
+      <h3>4.2. Missing Rates - post-QC</h3>''' + two_plots_html(plot(4), plot(5)))
+            file.write('''
       <h3>4.3. Fstat - pre-QC</h3>
-        ''' + qc_plots_list[6] + '''
-        
+        ''' + plot(6) + '''
+        ''')
+
+            file.write('''
       <h2>5. Per SNP Characteristics Analysis</h3>
-      <h3>5.1. pre-QC missing rate</h3>
-      <div class="outer-container">
-        <div>
-          ''' + qc_plots_list[7] + '''
-        </div>
-        <div>
-          ''' + qc_plots_list[8] + '''
-        </div>
-      </div>
-      
-      <h3>5.2. post-QC missing rate</h3>
-      <div class="outer-container">
-        <div>
-          ''' + qc_plots_list[9] + '''
-        </div>
-        <div>
-          ''' + qc_plots_list[10] + '''
-        </div>
-      </div>
-      
+      <h3>5.1. pre-QC missing rate</h3>''' + two_plots_html(plot(7), plot(8)))
+            file.write('''
+      <h3>5.2. post-QC missing rate</h3>''' + two_plots_html(plot(9), plot(10)))
+
+        # optional per-stage timings from the run manifest
+        if len(qc_tables_list) > 2 and qc_tables_list[2] is not None:
+            file.write('''
+      <h2>6. Run timings</h2>
+      ''' + qc_tables_list[2] + '''
+    ''')
+
+        file.write('''
     </body>
     </html>
-    '''
+    ''')
 
-    outhtml = dirname + 'report.html'
-    file = open(outhtml, "w")
-    file.write(text)
-    file.close()
\ No newline at end of file
+
+def write_sweep_report(dirname, basename, sweep_html):
+    """
+    Write the threshold sweep table to dirname/sweep_report.html
+    :param dirname: output directory
+    :param basename: data basename
+    :param sweep_html: HTML table returned by sweep.write_sweep
+    """
+    from datetime import date
+    today = date.today().strftime("%B %d, %Y")
+
+    with open(dirname + 'sweep_report.html', "w") as file:
+        file.write('''
+    <!doctype html>
+
+    <html lang="en">
+    <head style="margin:100px;padding:35px">
+      <meta charset="utf-8">
+
+      <title>preimpQC Threshold Sweep</title>
+    </head>
+
+    <body style="margin:100px;padding:35px">
+      <h1 style="text-align:center;font-weight:normal">Threshold sweep of ''' + basename + ''' </h1>
+      <h3 style="text-align:center;font-weight:normal;">''' + today + ''' </h3><br>
+
+      <h2>Exclusions per threshold combination</h2>
+      <p>SNP counts include the pre-filter and the invariant SNPs. All variant filters are evaluated on the metrics
+      before sample QC, so the counts are an estimate of a full run with the same thresholds.</p>
+      ''' + sweep_html + '''
+    </body>
+    </html>
+    ''')
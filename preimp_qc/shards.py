@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import hail as hl
+
+
+def shard_intervals(mt: hl.MatrixTable, shard_bp: int = None) -> List[hl.expr.IntervalExpression]:
+    """
+    :param mt: Hail MatrixTable keyed by locus and alleles
+    :param shard_bp: if set, contigs are split into windows of this length, otherwise one shard per contig
+    :return: disjoint locus intervals in reference order, covering the variants of mt. Windows without any variant
+    are not returned, each shard is its own Hail job and checkpoint
+    """
+    rg = mt.locus.dtype.reference_genome
+    # row-only pass, the metrics input is checkpointed after sample QC. Only the (contig, window) pairs holding a
+    # variant reach the driver
+    window_index = (mt.locus.position - 1) // shard_bp if shard_bp else hl.int32(0)
+    present = mt.aggregate_rows(hl.agg.collect_as_set(hl.tuple([mt.locus.contig, window_index])))
+
+    windows: Dict[str, List[int]] = {}
+    for contig, index in present:
+        windows.setdefault(contig, []).append(index)
+
+    intervals = []
+    for contig in rg.contigs:
+        length = rg.lengths[contig]
+        window = shard_bp if shard_bp else length
+        for index in sorted(windows.get(contig, [])):
+            start = index * window + 1
+            intervals.append(hl.locus_interval(contig, start, min(start + window - 1, length), includes_end=True,
+                                               reference_genome=rg))
+
+    return intervals
+
+
+def run_sharded(mt: hl.MatrixTable, fn: Callable[[hl.MatrixTable], Tuple[hl.MatrixTable, Dict[str, int]]],
+                n_workers: int, tmp_prefix: str = None, shard_bp: int = None) -> Tuple[hl.MatrixTable, Dict[str, int]]:
+    """
+    Run a variant-only step on genomic shards as concurrent Hail jobs and merge the shards back in sorted order. Only
+    valid for steps where the decision for a variant depends on that variant alone
+    :param mt: Hail MatrixTable
+    :param fn: function of a shard returning the filtered shard and its counts
+    :param n_workers: number of shards processed at the same time
+    :param tmp_prefix: path prefix of the shard outputs, defaults to the Hail temporary directory
+    :param shard_bp: shard length in bp, one shard per contig if None
+    :return: merged MatrixTable, counts summed over the shards
+    """
+    intervals = shard_intervals(mt, shard_bp)
+    if not intervals:
+        return fn(mt)
+
+    def run_shard(i):
+        shard, results = fn(hl.filter_intervals(mt, [intervals[i]]))
+        if tmp_prefix:
+            path = '{}variant_shard_{}.mt'.format(tmp_prefix, i)
+        else:
+            path = hl.utils.new_temp_file('variant_shard', 'mt')
+        return shard.checkpoint(path, overwrite=True), results
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        outputs = list(executor.map(run_shard, range(len(intervals))))
+
+    # the shards are disjoint and in reference order, so the union is sorted
+    shards = [shard for shard, _ in outputs]
+    merged = shards[0].union_rows(*shards[1:])
+    results = {field: sum(shard_results[field] for _, shard_results in outputs) for field in outputs[0][1]}
+
+    return merged, results
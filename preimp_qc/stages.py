@@ -0,0 +1,177 @@
+import hashlib
+import json
+import pickle
+from typing import Any, Callable, Dict, Tuple
+
+import hail as hl
+
+
+def checkpoint_stage(mt: hl.MatrixTable, stage: str, sample_boundary: bool = False, checkpoint_dir: str = None,
+                     checkpoint_policy: str = 'none') -> hl.MatrixTable:
+    """
+    Cut the lazy pipeline at a stage boundary so later steps read the stage output instead of recomputing the whole
+    lineage from the input files
+    :param mt: Hail MatrixTable
+    :param stage: stage name, used for the checkpoint path
+    :param sample_boundary: True if this is the boundary after the sample filters
+    :param checkpoint_dir: directory for native checkpoints. If None, the MatrixTable is persisted in memory instead
+    :param checkpoint_policy: none, samples (after the sample filters only) or stages (after every stage)
+    :return: Hail MatrixTable backed by the checkpoint
+    """
+    if checkpoint_policy == 'none' or (checkpoint_policy == 'samples' and not sample_boundary):
+        return mt
+
+    if checkpoint_dir is None:
+        return mt.persist()
+
+    return mt.checkpoint('{}{}.mt'.format(checkpoint_dir, stage), overwrite=True)
+
+
+# row and column fields set by the stages. With exclusion codes (test_qc.init_exclusions) no stage drops rows or
+# columns or changes the entries, so a stored stage is only these annotations, joined back onto the stage input
+STAGE_ROW_FIELDS = ['variant_metrics', 'variant_exclusion']
+STAGE_COL_FIELDS = ['sample_metrics', 'sample_exclusion']
+
+
+def stage_key(parent_key: str, stage: str, params: Dict) -> str:
+    """
+    :param parent_key: key of the stage input
+    :param stage: stage name
+    :param params: parameters that affect the stage output
+    :return: hex digest identifying the stage output
+    """
+    description = {'parent': parent_key, 'stage': stage, 'params': params}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class StageRunner:
+    """
+    Runs the run_qc stages. With a stage_dir, every stage output is stored under a key made from the key of its input
+    and the parameters that affect it, so a rerun loads every unchanged stage and resumes from the first invalidated
+    one. Stages with exclusion codes store their row and column annotations only. Without a stage_dir, the
+    MatrixTable is checkpointed according to the checkpoint policy
+    """
+
+    def __init__(self, basename: str, input_key: str = None, stage_dir: str = None, checkpoint_dir: str = None,
+                 checkpoint_policy: str = 'none'):
+        self.basename = basename
+        self.key = input_key if input_key else 'input'
+        self.stage_dir = stage_dir
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_policy = checkpoint_policy
+        # stage persisted in memory, released when the next stage is persisted
+        self._persisted = None
+
+    def _path(self, stage: str, key: str) -> str:
+        return '{}{}_{}_{}'.format(self.stage_dir, self.basename, stage, key)
+
+    @staticmethod
+    def _annotations_only(mt: hl.MatrixTable) -> bool:
+        return 'variant_exclusion' in mt.row and 'sample_exclusion' in mt.col
+
+    @staticmethod
+    def _write_annotations(mt: hl.MatrixTable, path: str):
+        rows = mt.rows().select(*[field for field in STAGE_ROW_FIELDS if field in mt.row])
+        rows.write(path + '.rows.ht', overwrite=True)
+        cols = mt.cols().select(*[field for field in STAGE_COL_FIELDS if field in mt.col])
+        cols.write(path + '.cols.ht', overwrite=True)
+
+    @staticmethod
+    def _read_annotations(mt: hl.MatrixTable, path: str) -> hl.MatrixTable:
+        rows = hl.read_table(path + '.rows.ht')
+        cols = hl.read_table(path + '.cols.ht')
+        mt = mt.annotate_rows(**rows[mt.row_key])
+        return mt.annotate_cols(**cols[mt.col_key])
+
+    @staticmethod
+    def _save(path: str, results: Any) -> Any:
+        # Tables are written next to the results, the pickle is written last and marks the stage as complete
+        if isinstance(results, dict):
+            results = {field: value.checkpoint('{}.{}.ht'.format(path, field), overwrite=True)
+                       if isinstance(value, hl.Table) else value for field, value in results.items()}
+            stored = {field: {'_table': '{}.{}.ht'.format(path, field)} if isinstance(value, hl.Table) else value
+                      for field, value in results.items()}
+        else:
+            stored = results
+
+        with hl.hadoop_open(path + '.results.pkl', 'wb') as f:
+            pickle.dump(stored, f)
+
+        return results
+
+    @staticmethod
+    def _load(path: str) -> Tuple[bool, Any]:
+        if not hl.hadoop_exists(path + '.results.pkl'):
+            return False, None
+
+        with hl.hadoop_open(path + '.results.pkl', 'rb') as f:
+            results = pickle.load(f)
+        if isinstance(results, dict):
+            results = {field: hl.read_table(value['_table']) if isinstance(value, dict) and '_table' in value
+                       else value for field, value in results.items()}
+
+        return True, results
+
+    def run(self, mt: hl.MatrixTable, stage: str, params: Dict,
+            fn: Callable[[hl.MatrixTable], Tuple[hl.MatrixTable, Any]],
+            sample_boundary: bool = False) -> Tuple[hl.MatrixTable, Any]:
+        """
+        Run a stage that transforms the MatrixTable. With exclusion codes, a stored stage is its row and column
+        annotations (STAGE_ROW_FIELDS, STAGE_COL_FIELDS), not a copy of the genotypes
+        :param mt: stage input
+        :param stage: stage name
+        :param params: parameters that affect the stage output
+        :param fn: function of the input returning the output MatrixTable and the stage results
+        :param sample_boundary: True if this is the boundary after the sample filters
+        :return: output MatrixTable, stage results
+        """
+        if self.stage_dir is None:
+            mt, results = fn(mt)
+            cut = checkpoint_stage(mt, '{}_{}'.format(self.basename, stage), sample_boundary, self.checkpoint_dir,
+                                   self.checkpoint_policy)
+            if cut is not mt and self.checkpoint_dir is None:
+                # persist() has already computed the new stage, later stages only read from it
+                if self._persisted is not None:
+                    self._persisted.unpersist()
+                self._persisted = cut
+            return cut, results
+
+        self.key = stage_key(self.key, stage, params)
+        path = self._path(stage, self.key)
+        found, results = self._load(path)
+        if found:
+            print("Resuming {} from {}".format(stage, path))
+            if self._annotations_only(mt):
+                return self._read_annotations(mt, path), results
+            return hl.read_matrix_table(path + '.mt'), results
+
+        output, results = fn(mt)
+        if self._annotations_only(mt):
+            # later stages read the stored annotations instead of recomputing the lineage of the stage
+            self._write_annotations(output, path)
+            output = self._read_annotations(mt, path)
+        else:
+            output = output.checkpoint(path + '.mt', overwrite=True)
+
+        return output, self._save(path, results)
+
+    def results(self, mt: hl.MatrixTable, stage: str, params: Dict, fn: Callable[[hl.MatrixTable], Any]) -> Any:
+        """
+        Run a stage that only computes results (counts, plot data, sex imputation) from the MatrixTable. It is keyed
+        on its input like the other stages but does not change the key of the MatrixTable
+        :param mt: stage input
+        :param stage: stage name
+        :param params: parameters that affect the results
+        :param fn: function of the input returning the results
+        :return: stage results
+        """
+        if self.stage_dir is None:
+            return fn(mt)
+
+        path = self._path(stage, stage_key(self.key, stage, params))
+        found, results = self._load(path)
+        if found:
+            print("Resuming {} from {}".format(stage, path))
+            return results
+
+        return self._save(path, fn(mt))
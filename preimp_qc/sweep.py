@@ -0,0 +1,106 @@
+import itertools
+from typing import Callable, List
+
+import hail as hl
+
+import preimp_qc.test_qc as qc
+
+
+def threshold_flags(value: hl.Float64Expression, grid: List[float],
+                    fails: Callable[[hl.Expression, hl.Expression], hl.BooleanExpression]) -> hl.ArrayExpression:
+    """
+    :param value: metric the filter is applied to
+    :param grid: thresholds
+    :param fails: function of the metric and a threshold, True if the row/column is removed at that threshold
+    :return: one flag per threshold. A missing metric never fails a filter, same as remove_rows/remove_cols
+    """
+    return hl.literal(grid, hl.tarray(hl.tfloat64)).map(lambda threshold: hl.coalesce(fails(value, threshold), False))
+
+
+def sweep_thresholds(mt: hl.MatrixTable, pre_geno: float, geno_grid: List[float], midi_grid: List[float],
+                     mind_grid: List[float], maf_grid: List[float], hwe_con_grid: List[float],
+                     hwe_cas_grid: List[float], withpna: int = 0, metrics_computed: bool = False):
+    """
+    Evaluate the exclusion counts of every combination of the threshold grids from a single metrics pass: one column
+    aggregation for the sample call rate and one row aggregation that sums, per combination, the variants failing any
+    of the variant filters. The cost is roughly one QC pass whatever the number of combinations.
+
+    This is a what-if estimate: all variant filters are evaluated on the metrics computed after the pre-filter (step
+    1, not swept) and before sample QC, while run_qc recomputes the variant metrics after removing samples. The sex
+    filters (steps 3-4) are not swept
+    :param mt: Hail MatrixTable
+    :param pre_geno: step 1 call rate threshold
+    :param geno_grid: step 6 thresholds
+    :param midi_grid: step 7 thresholds
+    :param mind_grid: step 2 thresholds
+    :param maf_grid: step 9 thresholds
+    :param hwe_con_grid: step 10 thresholds
+    :param hwe_cas_grid: step 11 thresholds
+    :param withpna: 1 to keep the invariant SNPs (step 8)
+    :param metrics_computed: the input already carries the base variant_metrics and sample_metrics
+    :return: pandas DataFrame with one row per combination
+    """
+    import pandas as pd
+
+    if not metrics_computed:
+        mt = qc.compute_qc_metrics(mt)
+
+    # step 1 is applied once, the sample call rates are computed on the remaining variants like in run_qc
+    mt, pre_filter = qc.filter_var_cr(mt, pre_geno)
+    mt = qc.compute_sample_metrics(mt)
+
+    # samples with a missing phenotype are not tested, same as filter_sample_cr
+    sample_flags = threshold_flags(mt.sample_metrics.call_rate, mind_grid,
+                                   lambda call_rate, mind: (call_rate < 1 - mind) & hl.is_defined(mt.is_case))
+    samples = mt.aggregate_cols(hl.struct(n=hl.agg.count(), removed=hl.agg.array_sum(sample_flags.map(hl.int))))
+
+    vm = mt.variant_metrics
+    mt = mt.annotate_rows(sweep_flags=hl.struct(
+        geno=threshold_flags(vm.call_rate, geno_grid, lambda call_rate, geno: call_rate < 1 - geno),
+        midi=threshold_flags(vm.missing_diff, midi_grid, lambda missing_diff, midi: missing_diff > midi),
+        maf=threshold_flags(hl.min(vm.AF), maf_grid, lambda af, maf: af < maf),
+        hwe_con=threshold_flags(vm.p_value_hwe_controls, hwe_con_grid, lambda p, threshold: p < threshold),
+        hwe_cas=threshold_flags(vm.p_value_hwe_cases, hwe_cas_grid, lambda p, threshold: p < threshold),
+        invariant=hl.coalesce(hl.min(vm.AC) == 0, False) if withpna == 0 else hl.bool(False)))
+
+    # indices into the grids of every variant filter combination
+    combos = list(itertools.product(range(len(geno_grid)), range(len(midi_grid)), range(len(maf_grid)),
+                                    range(len(hwe_con_grid)), range(len(hwe_cas_grid))))
+    flags = mt.sweep_flags
+    removed = hl.literal(combos, hl.tarray(hl.ttuple(hl.tint32, hl.tint32, hl.tint32, hl.tint32, hl.tint32))).map(
+        lambda c: hl.int(flags.invariant | flags.geno[c[0]] | flags.midi[c[1]] | flags.maf[c[2]] |
+                         flags.hwe_con[c[3]] | flags.hwe_cas[c[4]]))
+    variants = mt.aggregate_rows(hl.struct(n=hl.agg.count(),
+                                           geno=hl.agg.array_sum(flags.geno.map(hl.int)),
+                                           midi=hl.agg.array_sum(flags.midi.map(hl.int)),
+                                           maf=hl.agg.array_sum(flags.maf.map(hl.int)),
+                                           hwe_con=hl.agg.array_sum(flags.hwe_con.map(hl.int)),
+                                           hwe_cas=hl.agg.array_sum(flags.hwe_cas.map(hl.int)),
+                                           removed=hl.agg.array_sum(removed)))
+
+    rows = []
+    for mind_i, mind in enumerate(mind_grid):
+        for combo_i, (geno_i, midi_i, maf_i, hwe_con_i, hwe_cas_i) in enumerate(combos):
+            snps_removed = pre_filter['geno_removed'] + variants.removed[combo_i]
+            rows.append([geno_grid[geno_i], midi_grid[midi_i], mind, maf_grid[maf_i], hwe_con_grid[hwe_con_i],
+                         hwe_cas_grid[hwe_cas_i], samples.removed[mind_i], samples.n - samples.removed[mind_i],
+                         variants.geno[geno_i], variants.midi[midi_i], variants.maf[maf_i],
+                         variants.hwe_con[hwe_con_i], variants.hwe_cas[hwe_cas_i], snps_removed,
+                         variants.n - variants.removed[combo_i]])
+
+    columns = ['geno', 'midi', 'mind', 'maf', 'hwe_th_con', 'hwe_th_cas', 'samples_removed', 'samples_remaining',
+               'snps_geno', 'snps_midi', 'snps_maf', 'snps_hwe_con', 'snps_hwe_cas', 'snps_removed', 'snps_remaining']
+
+    return pd.DataFrame(rows, columns=columns)
+
+
+def write_sweep(sweep, dirname: str, basename: str) -> str:
+    """
+    :param sweep: DataFrame returned by sweep_thresholds
+    :param dirname: output directory
+    :param basename: data basename
+    :return: HTML table of the sweep, the TSV is written to dirname/basename_threshold_sweep.tsv
+    """
+    sweep.to_csv(dirname + basename + '_threshold_sweep.tsv', sep='\t', index=False)
+
+    return sweep.to_html(index=False)
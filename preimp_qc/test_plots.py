@@ -1,80 +1,228 @@
-from plotnine import *
-import hail as hl
-import matplotlib.pyplot as plt
-from qqman import qqman
-import base64
 import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
+# plotnine, matplotlib, pandas and numpy are imported by the functions that render and Hail by the functions that
+# extract plot data, so importing this module (the CLI, the plot workers, --report_only) does not load either stack
+
+
+# histograms are small vector images, the Manhattan/QQ scatter is rasterised
+HIST_FORMAT = 'svg'
+SCATTER_FORMAT = 'webp'
+
+
+def plt_to_image(plot, fmt=HIST_FORMAT):
+    """
+    Render a plotnine plot
+    :return: dict with the image format and bytes, the report decides whether to inline or write it
+    """
+    buffer = io.BytesIO()
+    plot.save(buffer, format=fmt, verbose=False)
+
+    return {'format': fmt, 'data': buffer.getvalue()}
+
+
+def figure_to_image(figure, fmt=SCATTER_FORMAT):
+    """
+    Render a matplotlib figure, WebP falls back to an optimised PNG if Pillow has no WebP support
+    :return: dict with the image format and bytes
+    """
+    import matplotlib.pyplot as plt
+
+    if fmt not in figure.canvas.get_supported_filetypes():
+        fmt = 'png'
+    pil_kwargs = {'optimize': True} if fmt == 'png' else {'quality': 90}
 
-def plt_to_base64(plt):
     buffer = io.BytesIO()
-    plt.save(buffer, format='PNG', verbose=False)
-    buffer.seek(0)
+    figure.savefig(buffer, format=fmt, pil_kwargs=pil_kwargs)
+    plt.close(figure)
+
+    return {'format': fmt, 'data': buffer.getvalue()}
+
+
+# collect_arrays stops at this many rows. Every field costs 8 bytes per row in the result and, while a batch is
+# converted, about as much again in Arrow buffers: the driver needs at most ~16 * COLLECT_MAX_ROWS bytes per field
+# (160 MB at the default). Variant-level plots in run_qc aggregate in Hail instead and never collect per-row values
+COLLECT_MAX_ROWS = 10000000
+
+# session settings for the Arrow transfer of DataFrame.toPandas, set for the call only. The fallback to the row by row
+# conversion is disabled, so a column Arrow cannot transfer raises instead of silently collecting Python objects
+ARROW_CONF = {'spark.sql.execution.arrow.pyspark.enabled': 'true',
+              'spark.sql.execution.arrow.pyspark.fallback.enabled': 'false'}
+# the settings are session-wide, concurrent batch cohorts must not restore them in the middle of another transfer
+_arrow_conf_lock = threading.Lock()
+
+
+def collect_arrays(ht, max_rows=COLLECT_MAX_ROWS, **fields):
+    """
+    Collect numeric fields of a Hail Table as typed float64 NumPy arrays. The table is exported to Spark and
+    transferred as Arrow record batches (one buffer per column, no Python object per row), booleans become 1.0/0.0
+    and missing values NaN. Other backends fall back to one hl.agg.collect per field
+    :param ht: Hail Table
+    :param max_rows: raise ValueError if ht has more rows, see COLLECT_MAX_ROWS for the memory bound
+    :param fields: name=numeric or boolean expression of ht, e.g. call_rate=ht.sample_metrics.call_rate
+    :return: dict of name: float64 NumPy array, in the row order of ht
+    """
+    import hail as hl
+    import numpy as np
+
+    ht = ht.select(**{name: hl.float64(expr) for name, expr in fields.items()})
+    ht = ht.key_by().select(*fields).head(max_rows + 1)
+
+    try:
+        df = ht.to_spark()
+        conf = df.sparkSession.conf
+        with _arrow_conf_lock:
+            previous = {key: conf.get(key, None) for key in ARROW_CONF}
+            try:
+                for key, value in ARROW_CONF.items():
+                    conf.set(key, value)
+                columns = df.toPandas()
+            finally:
+                for key, value in previous.items():
+                    if value is None:
+                        conf.unset(key)
+                    else:
+                        conf.set(key, value)
+        arrays = {name: columns[name].to_numpy(dtype=np.float64, na_value=np.nan) for name in fields}
+    except NotImplementedError:
+        # only the Spark backend can export to Spark
+        collected = ht.aggregate(hl.struct(**{name: hl.agg.collect(ht[name]) for name in fields}))
+        arrays = {name: np.array([np.nan if v is None else v for v in collected[name]], dtype=np.float64)
+                  for name in fields}
+
+    n_rows = len(next(iter(arrays.values()))) if arrays else 0
+    if n_rows > max_rows:
+        raise ValueError("more than {} rows to collect, aggregate the table in Hail (e.g. cr_var_data) or raise "
+                         "max_rows".format(max_rows))
+
+    return arrays
+
+
+# call rates are binned in Hail on a fine grid over [0, 1], then merged into at most CR_PLOT_BINS bars over the
+# occupied range, so only a few hundred numbers per histogram reach Python
+CR_HIST_BINS = 400
+CR_PLOT_BINS = 40
+
+
+def cr_hist_expr(call_rate):
+    import hail as hl
+
+    return hl.agg.hist(call_rate, 0, 1, CR_HIST_BINS)
+
+
+def hist_to_dict(hist):
+    # plain python so it can be sent to the plot pool
+    return {'bin_edges': list(hist.bin_edges), 'bin_freq': list(hist.bin_freq)}
+
+
+def cr_hist_array(call_rate):
+    """
+    Same binning as cr_hist_expr, from a NumPy array of call rates (missing values are NaN and not counted)
+    :return: dict as returned by hist_to_dict
+    """
+    import numpy as np
+
+    call_rate = np.asarray(call_rate, dtype=float)
+    freq, edges = np.histogram(call_rate[~np.isnan(call_rate)], bins=CR_HIST_BINS, range=(0, 1))
+
+    return {'bin_edges': edges.tolist(), 'bin_freq': freq.tolist()}
+
+
+def rebin_hist(hist):
+    """
+    Merge the fine call rate bins computed by hl.agg.hist into at most CR_PLOT_BINS bins over the occupied range
+    :param hist: result of cr_hist_expr, as returned by hist_to_dict
+    :return: pandas DataFrame with xmin, xmax and count columns
+    """
+    import pandas as pd
 
-    plt_base64 = base64.b64encode(buffer.read()).decode('ascii')
-    return '<img src="data:image/png;base64,{}">'.format(plt_base64)
+    edges, freq = hist['bin_edges'], hist['bin_freq']
+    occupied = [i for i, n in enumerate(freq) if n > 0]
+    first = occupied[0] if occupied else len(freq) - 1
+    width = -(-(len(freq) - first) // CR_PLOT_BINS)
+
+    rows = []
+    for i in range(first, len(freq), width):
+        j = min(i + width, len(freq))
+        rows.append([edges[i], edges[j], sum(freq[i:j])])
+
+    return pd.DataFrame(rows, columns=['xmin', 'xmax', 'count'])
 
 
 def plt_cr(df, threshold, title):
+    from plotnine import ggplot, aes, geom_rect, geom_vline, labs, theme_bw
 
-    plt_cr = ggplot(df, aes(x='call_rate')) + \
-             geom_histogram(bins=40, color="black", fill="blue") + \
+    plt_cr = ggplot(df) + \
+             geom_rect(aes(xmin='xmin', xmax='xmax', ymin=0, ymax='count'), color="black", fill="blue") + \
              geom_vline(xintercept=1 - threshold, linetype="dashed", color="red") + \
-             labs(title=title, y="Frequency") + \
+             labs(title=title, x="call_rate", y="Frequency") + \
              theme_bw()
 
     return plt_cr
 
 
+def render_cr(hist, threshold, title):
+    return plt_to_image(plt_cr(rebin_hist(hist), threshold, title))
+
+
+def cr_var_data(mt):
+    import hail as hl
+
+    # case-only and control-only call rates are precomputed per variant, one row aggregation bins both
+    cr = mt.variant_metrics
+    cr_hists = mt.aggregate_rows(hl.struct(cases=cr_hist_expr(cr.call_rate_cases),
+                                           controls=cr_hist_expr(cr.call_rate_controls)))
+
+    return {'cases': hist_to_dict(cr_hists.cases), 'controls': hist_to_dict(cr_hists.controls)}
+
+
 def cr_var_plts(mt, geno):
+    cr_hists = cr_var_data(mt)
 
-    from .test_qc import stats_split_mt
+    cas_var_plt = render_cr(cr_hists['cases'], geno, "Cases variant call rate")
+    con_var_plt = render_cr(cr_hists['controls'], geno, "Controls variant call rate")
 
-    mt_cases, mt_controls = stats_split_mt(mt)
-    cas_cr_ht_row = mt_cases.rows()
-    con_cr_ht_row = mt_controls.rows()
+    return cas_var_plt, con_var_plt
 
-    cas_cr_var = cas_cr_ht_row.select(cas_cr_ht_row.variant_qc.call_rate)
-    con_cr_var = con_cr_ht_row.select(con_cr_ht_row.variant_qc.call_rate)
 
-    # convert the ht to pd (this conversion is the one taking most time, FIND EFFICIENT WAY)
-    cas_var_df = cas_cr_var.to_pandas()
-    con_var_df = con_cr_var.to_pandas()
+def cr_id_data(mt):
+    import hail as hl
 
-    cas_var_plt = plt_cr(cas_var_df, geno, "Cases variant call rate")
-    cas_var_plt64 = plt_to_base64(cas_var_plt)
-    con_var_plt = plt_cr(con_var_df, geno, "Controls variant call rate")
-    con_var_plt64 = plt_to_base64(con_var_plt)
+    # one column aggregation bins cases and controls
+    cr = mt.sample_metrics.call_rate
+    cr_hists = mt.aggregate_cols(hl.struct(cases=hl.agg.filter(mt.is_case == True, cr_hist_expr(cr)),
+                                           controls=hl.agg.filter(mt.is_case == False, cr_hist_expr(cr))))
 
-    return cas_var_plt64, con_var_plt64
+    return {'cases': hist_to_dict(cr_hists.cases), 'controls': hist_to_dict(cr_hists.controls)}
 
 
 def cr_id_plts(mt, mind):
-    from .test_qc import stats_split_mt
-    mt_cases, mt_controls = stats_split_mt(mt)
-    cas_cr_ht_col = mt_cases.cols()
-    con_cr_ht_col = mt_controls.cols()
+    cr_hists = cr_id_data(mt)
 
-    # select the call_rate col for both samples and snps
-    cas_cr_id = cas_cr_ht_col.select(cas_cr_ht_col.sample_qc.call_rate)
-    con_cr_id = con_cr_ht_col.select(con_cr_ht_col.sample_qc.call_rate)
+    cas_id_plt = render_cr(cr_hists['cases'], mind, "Cases sample call rate")
+    con_id_plt = render_cr(cr_hists['controls'], mind, "Controls sample call rate")
 
-    # convert the ht to pd (this conversion is the one taking most time, FIND EFFICIENT WAY)
-    cas_id_df = cas_cr_id.to_pandas()
-    con_id_df = con_cr_id.to_pandas()
+    return cas_id_plt, con_id_plt
 
-    cas_id_plt = plt_cr(cas_id_df, mind, "Cases sample call rate")
-    cas_id_plt64 = plt_to_base64(cas_id_plt)
-    con_id_plt = plt_cr(con_id_df, mind, "Controls sample call rate")
-    con_id_plt64 = plt_to_base64(con_id_plt)
 
-    return cas_id_plt64, con_id_plt64
+def fstat_data(imputed_sex_ht):
+    """
+    :return: dict with the is_female (1.0, 0.0 or NaN) and f_stat NumPy arrays
+    """
+    return collect_arrays(imputed_sex_ht, is_female=imputed_sex_ht.is_female, f_stat=imputed_sex_ht.f_stat)
 
 
-def fstat_plt(imputed_sex_ht, female_thresh, male_thresh):
-    fstat_df = imputed_sex_ht.to_pandas()
-    fstat_df['is_female'] = fstat_df['is_female'].astype(str)
-    fstat_df['is_female'] = fstat_df['is_female'].replace(['True', 'False', 'None'], ['female', 'male', 'unspecified'])
+def render_fstat(fstat, female_thresh, male_thresh):
+    import numpy as np
+    import pandas as pd
+    from plotnine import ggplot, aes, geom_histogram, geom_vline, scale_fill_manual, labs, theme_bw
+
+    is_female = np.asarray(fstat['is_female'], dtype=np.float64)
+    fstat_df = pd.DataFrame({'f_stat': fstat['f_stat'],
+                             'is_female': np.where(np.isnan(is_female), 'unspecified',
+                                                   np.where(is_female == 1, 'female', 'male'))})
 
     sex_colors = {"male": "blue", "female": "purple", "unspecified": "red"}
     f_stat_plot = ggplot(fstat_df, aes(x='f_stat', fill='is_female')) + \
@@ -86,37 +234,228 @@ def fstat_plt(imputed_sex_ht, female_thresh, male_thresh):
                        x="F-statistic", y="Frequency") + \
                   theme_bw()
 
-    f_stat_plot64 = plt_to_base64(f_stat_plot)
+    return plt_to_image(f_stat_plot)
 
-    return f_stat_plot64
 
+def fstat_plt(imputed_sex_ht, female_thresh, male_thresh):
+    return render_fstat(fstat_data(imputed_sex_ht), female_thresh, male_thresh)
+
+
+# every variant with p below MANHATTAN_KEEP_P is drawn, the rest are thinned to one point per
+# (MANHATTAN_POS_BIN bp, MANHATTAN_MLP_BIN -log10 p) cell. QQ quantiles above it come from approx_quantiles
+MANHATTAN_KEEP_P = 1e-3
+MANHATTAN_POS_BIN = 1000000
+MANHATTAN_MLP_BIN = 0.05
+QQ_QUANTILES = [10 ** (-6 + 6 * i / 199) for i in range(200)]
+
+
+def manhattan_qq_data(ht):
+    """
+    Extract thinned Manhattan and QQ plot data in a single aggregation, the number of points returned scales with the
+    number of significant variants, not the number of variants
+    :param ht: Hail Table with locus and p_value fields
+    :return: dict with the reference genome contigs/lengths, significant points, thinned cells and QQ quantiles
+    """
+    import hail as hl
+
+    rg = ht.locus.dtype.reference_genome
+    ht = ht.filter(hl.is_defined(ht.p_value) & (ht.p_value > 0))
+    global_position = ht.locus.global_position()
+    mlp = -hl.log10(ht.p_value)
+    keep = ht.p_value < MANHATTAN_KEEP_P
+
+    data = ht.aggregate(hl.struct(
+        n=hl.agg.count(),
+        contigs=hl.agg.collect_as_set(ht.locus.contig),
+        significant=hl.agg.filter(keep, hl.agg.collect(hl.tuple([global_position, mlp]))),
+        thinned=hl.agg.filter(~keep, hl.agg.collect_as_set(
+            hl.tuple([global_position // MANHATTAN_POS_BIN, hl.int32(mlp / MANHATTAN_MLP_BIN)]))),
+        quantiles=hl.agg.approx_quantiles(ht.p_value, QQ_QUANTILES, k=1000)))
+
+    return {
+        'contigs': [contig for contig in rg.contigs if contig in data.contigs],
+        'contig_lengths': [rg.lengths[contig] for contig in rg.contigs],
+        'all_contigs': list(rg.contigs),
+        'n': data.n,
+        'significant': data.significant,
+        'thinned': list(data.thinned),
+        'quantiles': data.quantiles
+    }
+
+
+def reference_lengths(rg):
+    """
+    :param rg: Hail ReferenceGenome
+    :return: dict with the contigs of the reference genome, in order, and their lengths
+    """
+    return {'all_contigs': list(rg.contigs), 'contig_lengths': [rg.lengths[contig] for contig in rg.contigs]}
+
+
+def global_positions(contig, position, all_contigs, contig_lengths):
+    """
+    Same as locus.global_position() in Hail: offset of the contig in the reference genome + position - 1
+    :param contig: NumPy array of contig names
+    :param position: NumPy array of 1-based positions
+    :return: int64 NumPy array
+    """
+    import numpy as np
+
+    offsets = dict(zip(all_contigs, np.concatenate([[0], np.cumsum(contig_lengths)[:-1]]).tolist()))
+    contigs, contig_idx = np.unique(np.asarray(contig), return_inverse=True)
+
+    contig_offsets = np.array([offsets[c] for c in contigs], dtype=np.int64)
+
+    return contig_offsets[contig_idx] + np.asarray(position, dtype=np.int64) - 1
+
+
+def manhattan_qq_arrays(global_position, p_value, all_contigs, contig_lengths):
+    """
+    manhattan_qq_data from NumPy arrays (the Parquet QC metrics), without Hail. QQ quantiles
+    are exact
+    :param global_position: global position of each variant, see global_positions
+    :param p_value: association p value of each variant, NaN if missing
+    :param all_contigs: contigs of the reference genome, in order
+    :param contig_lengths: lengths of all_contigs
+    :return: dict as returned by manhattan_qq_data
+    """
+    import numpy as np
+
+    p_value = np.asarray(p_value, dtype=np.float64)
+    valid = ~np.isnan(p_value) & (p_value > 0)
+    global_position, p_value = np.asarray(global_position, dtype=np.int64)[valid], p_value[valid]
+
+    offsets = np.concatenate([[0], np.cumsum(contig_lengths)])
+    contig_idx = np.unique(np.searchsorted(offsets, global_position, side='right') - 1)
+    mlp = -np.log10(p_value)
+    keep = p_value < MANHATTAN_KEEP_P
+
+    thinned = np.unique(np.stack([global_position[~keep] // MANHATTAN_POS_BIN,
+                                  (mlp[~keep] / MANHATTAN_MLP_BIN).astype(np.int32)], axis=1), axis=0)
+    quantiles = np.quantile(p_value, QQ_QUANTILES).tolist() if len(p_value) else [None] * len(QQ_QUANTILES)
+
+    return {
+        'contigs': [all_contigs[i] for i in contig_idx],
+        'contig_lengths': list(contig_lengths),
+        'all_contigs': list(all_contigs),
+        'n': int(len(p_value)),
+        'significant': np.stack([global_position[keep], mlp[keep]], axis=1).tolist(),
+        'thinned': thinned.tolist(),
+        'quantiles': quantiles
+    }
+
+
+def manhattan_qq_render(data):
+    """
+    Draw the Manhattan and QQ plots from manhattan_qq_data output with vectorized matplotlib calls. Chromosomes are
+    ordered as in the reference genome, so X, Y and MT come after the autosomes
+    """
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    offsets = np.concatenate([[0], np.cumsum(data['contig_lengths'])])
+
+    sig = np.array(data['significant'], dtype=float).reshape(-1, 2)
+    thinned = np.array(data['thinned'], dtype=float).reshape(-1, 2)
+    x = np.concatenate([sig[:, 0], (thinned[:, 0] + 0.5) * MANHATTAN_POS_BIN])
+    y = np.concatenate([sig[:, 1], (thinned[:, 1] + 0.5) * MANHATTAN_MLP_BIN])
+    contig_idx = np.searchsorted(offsets, x, side='right') - 1
+    colors = np.where(contig_idx % 2 == 0, '#1f3a93', '#6b9bd1')
+
+    figure, axes = plt.subplots(nrows=1, ncols=2, figsize=(25, 10))
+
+    ax = axes[0]
+    ax.scatter(x, y, c=colors, s=4, linewidths=0)
+    ax.axhline(-np.log10(5e-8), color='red', linestyle='dashed', linewidth=1)
+    ax.axhline(-np.log10(1e-5), color='grey', linestyle='dashed', linewidth=1)
+    idx = [data['all_contigs'].index(contig) for contig in data['contigs']]
+    ax.set_xticks([(offsets[i] + offsets[i + 1]) / 2 for i in idx])
+    ax.set_xticklabels([contig.replace('chr', '') for contig in data['contigs']], rotation=90.0)
+    if idx:
+        ax.set_xlim(offsets[min(idx)], offsets[max(idx) + 1])
+    ax.set_xlabel('Chromosome')
+    ax.set_ylabel('-log10(p)')
+    ax.set_title('Manhattan plot')
+
+    # QQ: exact points for the significant tail, approximate quantiles for the rest
+    n = max(data['n'], 1)
+    sig_p = np.sort(10 ** -sig[:, 1])
+    expected = np.concatenate([np.arange(1, len(sig_p) + 1) / (n + 1), np.array(QQ_QUANTILES)])
+    observed = np.concatenate([sig_p, np.array(data['quantiles'], dtype=float)])
+    tail = np.arange(len(expected)) < len(sig_p)
+    body = ~tail & (expected > len(sig_p) / (n + 1))
+    expected, observed = -np.log10(expected[tail | body]), -np.log10(observed[tail | body])
+
+    ax = axes[1]
+    ax.scatter(expected, observed, s=6, c='#1f3a93', linewidths=0)
+    lim = max(expected.max(initial=1), observed.max(initial=1))
+    ax.plot([0, lim], [0, lim], color='red', linewidth=1)
+    ax.set_xlabel('Expected -log10(p)')
+    ax.set_ylabel('Observed -log10(p)')
+    ax.set_title('QQ plot')
+
+    figure.tight_layout()
+
+    return figure_to_image(figure)
+
+
+def association_ht(mt, association='regression'):
+    """
+    :param mt: Hail MatrixTable with variant_metrics
+    :param association: regression (linear regression of is_case on dosage, one pass over the genotypes) or allelic
+    (allelic chi-squared test already computed from the stratified genotype counts, no genotype pass)
+    :return: Hail Table keyed by locus and alleles with a p_value field
+    """
+    import hail as hl
 
-def man_qq_plts(mt):
+    if association == 'allelic':
+        gwas_ht = mt.rows()
+        return gwas_ht.select(p_value=gwas_ht.variant_metrics.p_value_allelic)
 
     gwas_ht = hl.linear_regression_rows(y=mt.is_case,
                                         x=mt.GT.n_alt_alleles(),
                                         covariates=[1.0])
+    return gwas_ht.select('p_value')
 
-    pvals = gwas_ht.select(gwas_ht.p_value)
-    man_df = pvals.to_pandas()
 
-    man_df_pruned = man_df[['locus.contig', 'locus.position', 'p_value']]
-    man_df_pruned.columns = ['CHR', 'BP', 'P']
-    man_df_pruned = man_df_pruned.dropna()
+def man_qq_data(mt, association='regression'):
+    return manhattan_qq_data(association_ht(mt, association))
 
-    man_df_pruned = man_df_pruned.replace(to_replace=["X", "Y", "MT"],
-                                          value=[23, 24, 25])
 
-    buffer = io.BytesIO()
-    figure, axes = plt.subplots(nrows=1, ncols=2, figsize=(25, 10))
-    qqman.manhattan(man_df_pruned, ax=axes[0], xrotation=90.0, title="Manhattan plot")
-    qqman.qqplot(man_df_pruned, ax=axes[1], title="QQ plot")
+def man_qq_plts(mt, association='regression'):
+    return manhattan_qq_render(man_qq_data(mt, association))
 
-    figure.tight_layout()
-    plt.savefig(buffer, format='PNG')
-    plt.clf()
-    plt.close()
-    buffer.seek(0)
 
-    plt_base64 = base64.b64encode(buffer.read()).decode('ascii')
-    return '<img src="data:image/png;base64,{}">'.format(plt_base64)
+def plot_pool(n_workers=None):
+    """
+    Process pool for rendering plots from extracted plot data while the driver keeps submitting Hail jobs. Workers
+    are spawned, not forked, so they don't inherit the Py4J connection to the JVM
+    :param n_workers: number of rendering processes, defaults to the number of cores
+    :return: ProcessPoolExecutor, submit the render_* functions to it
+    """
+    return ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def submit_plots(pool, data, mind, geno):
+    """
+    :param pool: plot_pool
+    :param data: plot data of a stage, dict with the 'var' and 'id' call rate histograms and the 'man_qq' data
+    :param mind: sample call rate threshold
+    :param geno: variant call rate threshold
+    :return: dict of futures of the rendered plots
+    """
+    return {'man_qq': pool.submit(manhattan_qq_render, data['man_qq']),
+            'cas_id': pool.submit(render_cr, data['id']['cases'], mind, "Cases sample call rate"),
+            'con_id': pool.submit(render_cr, data['id']['controls'], mind, "Controls sample call rate"),
+            'cas_var': pool.submit(render_cr, data['var']['cases'], geno, "Cases variant call rate"),
+            'con_var': pool.submit(render_cr, data['var']['controls'], geno, "Controls variant call rate")}
+
+
+def collect_plots(pre_plots, post_plots, f_stat_plot):
+    """
+    :return: rendered images in report.PLOT_NAMES order
+    """
+    plots = [pre_plots['man_qq'], post_plots['man_qq'], pre_plots['con_id'], pre_plots['cas_id'], post_plots['con_id'],
+             post_plots['cas_id'], f_stat_plot, pre_plots['con_var'], pre_plots['cas_var'], post_plots['con_var'],
+             post_plots['cas_var']]
+
+    return [plot.result() for plot in plots]
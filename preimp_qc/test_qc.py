@@ -2,60 +2,237 @@ import hail as hl
 from typing import List, Tuple, Dict
 
 
-def compute_qc_metrics(mt: hl.MatrixTable) -> hl.MatrixTable:
+def init_exclusions(mt: hl.MatrixTable) -> hl.MatrixTable:
     """
-    Compute per-sample metrics and common variant statistics useful for quality control
+    Add the variant_exclusion and sample_exclusion reason codes. The filters set the code of the rows/columns they
+    exclude instead of dropping them, and every metric only aggregates over the included rows/columns, so the full
+    input is kept for the exclusion tables. A missing code means included
     :param mt: Hail MatrixTable
-    :return: Hail MatrixTable with variant and sample qc metrics
+    :return: Hail MatrixTable with variant_exclusion and sample_exclusion fields
     """
-    mt: hl.MatrixTable = hl.variant_qc(mt)
-    mt: hl.MatrixTable = hl.sample_qc(mt)
+    return mt.annotate_rows(variant_exclusion=hl.missing(hl.tstr)).annotate_cols(sample_exclusion=hl.missing(hl.tstr))
 
-    return mt
 
+def variant_included(mt: hl.MatrixTable) -> hl.BooleanExpression:
+    return hl.is_missing(mt.variant_exclusion) if 'variant_exclusion' in mt.row else hl.bool(True)
 
-def stats_split_mt(mt: hl.MatrixTable) -> Tuple[hl.MatrixTable, hl.MatrixTable]:
-    mt_cases: hl.MatrixTable = mt.filter_cols(mt.is_case == True)
-    mt_controls: hl.MatrixTable = mt.filter_cols(mt.is_case == False)
 
-    return mt_cases, mt_controls
+def sample_included(mt: hl.MatrixTable) -> hl.BooleanExpression:
+    return hl.is_missing(mt.sample_exclusion) if 'sample_exclusion' in mt.col else hl.bool(True)
 
 
-def collect_counts(mt: hl.MatrixTable) -> List[int]:
+def included(mt: hl.MatrixTable) -> hl.MatrixTable:
+    """
+    :param mt: Hail MatrixTable
+    :return: the included rows and columns, for the plots, sex imputation and the export
+    """
+    mt = mt.filter_rows(variant_included(mt))
+    return mt.filter_cols(sample_included(mt))
+
+
+def genotype_counts(mt: hl.MatrixTable, in_group: hl.BooleanExpression) -> hl.StructExpression:
+    """
+    Aggregated per-variant genotype counts in a group of included samples
+    :param mt: Hail MatrixTable
+    :param in_group: boolean column expression selecting the samples
+    :return: struct aggregation with n (samples in the group), n_hom_ref, n_het and n_hom_var
+    """
+    return hl.agg.filter(in_group & sample_included(mt), hl.struct(n=hl.agg.count(),
+                                             n_hom_ref=hl.agg.count_where(mt.GT.is_hom_ref()),
+                                             n_het=hl.agg.count_where(mt.GT.is_het()),
+                                             n_hom_var=hl.agg.count_where(mt.GT.is_hom_var())))
+
+
+def call_rate(counts: hl.StructExpression) -> hl.Float64Expression:
+    return hl.or_missing(counts.n > 0, (counts.n_hom_ref + counts.n_het + counts.n_hom_var) / counts.n)
+
+
+def hwe_p_value(counts: hl.StructExpression) -> hl.Float64Expression:
+    return hl.hardy_weinberg_test(hl.int32(counts.n_hom_ref), hl.int32(counts.n_het),
+                                  hl.int32(counts.n_hom_var)).p_value
+
+
+def allelic_p_value(cases: hl.StructExpression, controls: hl.StructExpression) -> hl.Float64Expression:
+    """
+    Allelic chi-squared test of association from case and control genotype counts
+    :param cases: case genotype counts
+    :param controls: control genotype counts
+    :return: p-value, missing if a margin of the 2x2 allele table is empty
+    """
+    alt_cases = 2 * cases.n_hom_var + cases.n_het
+    ref_cases = 2 * cases.n_hom_ref + cases.n_het
+    alt_controls = 2 * controls.n_hom_var + controls.n_het
+    ref_controls = 2 * controls.n_hom_ref + controls.n_het
+    defined = ((alt_cases + alt_controls > 0) & (ref_cases + ref_controls > 0) &
+               (alt_cases + ref_cases > 0) & (alt_controls + ref_controls > 0))
+
+    return hl.or_missing(defined, hl.chi_squared_test(hl.int32(alt_cases), hl.int32(ref_cases),
+                                                      hl.int32(alt_controls), hl.int32(ref_controls)).p_value)
+
+
+def missingness_p_value(cases: hl.StructExpression, controls: hl.StructExpression) -> hl.Float64Expression:
+    """
+    Fisher's exact test of differential missingness between cases and controls (PLINK --test-missing)
+    :param cases: case genotype counts
+    :param controls: control genotype counts
+    :return: p-value, missing if either group is empty
+    """
+    called_cases = cases.n_hom_ref + cases.n_het + cases.n_hom_var
+    called_controls = controls.n_hom_ref + controls.n_het + controls.n_hom_var
+
+    return hl.or_missing((cases.n > 0) & (controls.n > 0),
+                         hl.fisher_exact_test(hl.int32(cases.n - called_cases), hl.int32(called_cases),
+                                              hl.int32(controls.n - called_controls),
+                                              hl.int32(called_controls)).p_value)
+
+
+def localize_metrics(mt: hl.MatrixTable, metrics: hl.Table) -> hl.MatrixTable:
+    """
+    Join checkpointed metrics back to the MatrixTable. The filters, counts and plots aggregate over the metrics many
+    times, reading them from the checkpointed table means the genotype pass that computed them runs once, whatever
+    the checkpoint policy
+    :param mt: Hail MatrixTable the metrics were computed from
+    :param metrics: checkpointed rows table with variant_metrics or columns table with sample_metrics
+    :return: Hail MatrixTable with the metrics field
+    """
+    if 'variant_metrics' in metrics.row:
+        return mt.annotate_rows(variant_metrics=metrics[mt.row_key].variant_metrics)
+    return mt.annotate_cols(sample_metrics=metrics[mt.col_key].sample_metrics)
+
+
+def compute_variant_metrics(mt: hl.MatrixTable) -> hl.MatrixTable:
     """
-    Collect basic stat counts and split the MatrixTable by phenotype status (for plots)
+    Compute every per-variant metric the pipeline needs in one pass over the genotypes: overall, case-only and
+    control-only genotype counts and AC/AF. Call rates, HWE, differential missingness and the allelic association test
+    are derived from the counts, so all aggregations live in a single annotate_rows and Hail fuses them
     :param mt: Hail MatrixTable
-    :return: basic stat counts, cases MatrixTable, controls MatrixTable
+    :return: Hail MatrixTable with a variant_metrics row field, read from a checkpointed rows table
     """
+    input_mt = mt
+    call_stats = hl.agg.filter(sample_included(mt), hl.agg.call_stats(mt.GT, mt.alleles))
+
+    mt = mt.annotate_rows(variant_metrics=hl.struct(
+        gt_counts=genotype_counts(mt, True),
+        gt_counts_cases=genotype_counts(mt, mt.is_case == True),
+        gt_counts_controls=genotype_counts(mt, mt.is_case == False),
+        AC=call_stats.AC,
+        AF=call_stats.AF))
+
+    vm = mt.variant_metrics
+    mt = mt.annotate_rows(variant_metrics=vm.annotate(
+        call_rate=call_rate(vm.gt_counts),
+        call_rate_cases=call_rate(vm.gt_counts_cases),
+        call_rate_controls=call_rate(vm.gt_counts_controls),
+        p_value_hwe=hwe_p_value(vm.gt_counts),
+        p_value_hwe_cases=hwe_p_value(vm.gt_counts_cases),
+        p_value_hwe_controls=hwe_p_value(vm.gt_counts_controls),
+        p_value_allelic=allelic_p_value(vm.gt_counts_cases, vm.gt_counts_controls),
+        p_value_missing=missingness_p_value(vm.gt_counts_cases, vm.gt_counts_controls)))
+
+    # case/control missing rate difference
+    vm = mt.variant_metrics
+    mt = mt.annotate_rows(variant_metrics=vm.annotate(
+        missing_diff=hl.abs(vm.call_rate_cases - vm.call_rate_controls)))
+
+    # checkpointed to a temporary file rather than persisted, the metrics tables replaced by the next computation
+    # would otherwise stay cached in the shared Spark session (batch runs) until it ends
+    return localize_metrics(input_mt, mt.rows().select('variant_metrics').checkpoint(hl.utils.new_temp_file()))
+
+
+def compute_sample_metrics(mt: hl.MatrixTable) -> hl.MatrixTable:
+    """
+    Compute per-sample call rate over the included variants in one pass over the genotypes
+    :param mt: Hail MatrixTable
+    :return: Hail MatrixTable with a sample_metrics column field, read from a checkpointed columns table
+    """
+    metrics = mt.annotate_cols(sample_metrics=hl.struct(
+        call_rate=hl.agg.filter(variant_included(mt), hl.agg.fraction(hl.is_defined(mt.GT)))))
 
-    # 1. Sex
-    n_females: List[str] = mt.filter_cols(mt.is_female == True).s.collect()
-    n_males: List[str] = mt.filter_cols(mt.is_female == False).s.collect()
-    n_sex_missing: List[str] = mt.filter_cols(hl.is_missing(mt.is_female)).s.collect()
+    return localize_metrics(mt, metrics.cols().select('sample_metrics').checkpoint(hl.utils.new_temp_file()))
+
+
+def compute_qc_metrics(mt: hl.MatrixTable) -> hl.MatrixTable:
+    """
+    Compute per-sample metrics and stratified variant statistics useful for quality control
+    :param mt: Hail MatrixTable
+    :return: Hail MatrixTable with variant and sample qc metrics
+    """
+    mt = compute_variant_metrics(mt)
+    mt = compute_sample_metrics(mt)
+
+    return mt
+
+
+def collect_counts(mt: hl.MatrixTable) -> List[int]:
+    """
+    Collect basic stat counts of the included samples and variants with a single column and a single row aggregation
+    :param mt: Hail MatrixTable
+    :return: basic stat counts [males, females, sex missing, cases, controls, phenotype missing, SNPs]
+    """
+    # 1. Sex and 2. Phenotype status, one sex x phenotype counter over the columns
+    sex_pheno_counts: Dict[hl.Struct, int] = mt.aggregate_cols(
+        hl.agg.filter(sample_included(mt), hl.agg.counter(hl.struct(is_female=mt.is_female, is_case=mt.is_case))))
 
-    # 2. Phenotype status
-    n_cases: List[str] = mt.filter_cols(mt.is_case == True).s.collect()
-    n_controls: List[str] = mt.filter_cols(mt.is_case == False).s.collect()
-    n_unknown_pheno: List[str] = mt.filter_cols(hl.is_missing(mt.is_case)).s.collect()
+    def n_where(field: str, value) -> int:
+        return sum(n for key, n in sex_pheno_counts.items() if key[field] == value)
 
     # 3. Number of SNPs
-    n_snps = mt.count_rows()
+    n_snps = mt.aggregate_rows(hl.agg.count_where(variant_included(mt)))
 
-    counts: List[int] = [len(n_males), len(n_females), len(n_sex_missing), len(n_cases),
-                         len(n_controls), len(n_unknown_pheno), n_snps]
+    counts: List[int] = [n_where('is_female', False), n_where('is_female', True), n_where('is_female', None),
+                         n_where('is_case', True), n_where('is_case', False), n_where('is_case', None), n_snps]
 
     return counts
 
 
-def filter_var_cr(mt: hl.MatrixTable, geno: float) -> Tuple[hl.MatrixTable, Dict[str, int]]:
+def remove_rows(mt: hl.MatrixTable, condition: hl.BooleanExpression,
+                reason: str = None) -> Tuple[hl.MatrixTable, int]:
+    """
+    Remove the included rows where condition is True. Rows with a missing condition are kept, like a filter on
+    collected IDs would. The count comes from a row aggregation, nothing is collected to the driver. With exclusion
+    codes (init_exclusions), the rows are marked with reason instead of dropped
+    :param mt: Hail MatrixTable
+    :param condition: boolean row expression, True for the rows to remove
+    :param reason: exclusion reason code
+    :return: filtered MatrixTable, number of rows removed
+    """
+    condition = hl.coalesce(condition, False) & variant_included(mt)
+    n_removed = mt.aggregate_rows(hl.agg.count_where(condition))
+    if 'variant_exclusion' in mt.row:
+        mt = mt.annotate_rows(variant_exclusion=hl.if_else(condition, reason, mt.variant_exclusion))
+    else:
+        mt = mt.filter_rows(condition, keep=False)
+
+    return mt, n_removed
+
+
+def remove_cols(mt: hl.MatrixTable, condition: hl.BooleanExpression,
+                reason: str = None, count: bool = True) -> Tuple[hl.MatrixTable, int]:
+    """
+    Remove the included columns where condition is True. Columns with a missing condition are kept. With exclusion
+    codes (init_exclusions), the columns are marked with reason instead of dropped
+    :param mt: Hail MatrixTable
+    :param condition: boolean column expression, True for the columns to remove
+    :param reason: exclusion reason code
+    :param count: count the removed columns. False if the caller already counted them in its own aggregation
+    :return: filtered MatrixTable, number of columns removed (None if not counted)
+    """
+    condition = hl.coalesce(condition, False) & sample_included(mt)
+    n_removed = mt.aggregate_cols(hl.agg.count_where(condition)) if count else None
+    if 'sample_exclusion' in mt.col:
+        mt = mt.annotate_cols(sample_exclusion=hl.if_else(condition, reason, mt.sample_exclusion))
+    else:
+        mt = mt.filter_cols(condition, keep=False)
+
+    return mt, n_removed
+
+
+def filter_var_cr(mt: hl.MatrixTable, geno: float, reason: str = 'geno') -> Tuple[hl.MatrixTable, Dict[str, int]]:
     # steps 1 and 6
-    mt = compute_qc_metrics(mt)
-    geno_cr_remove = mt.filter_rows(mt.variant_qc.call_rate < (1 - geno)).rsid.collect()
-    if len(geno_cr_remove) > 0:
-        mt = mt.filter_rows(hl.literal(geno_cr_remove).contains(mt['rsid']), keep=False)
+    mt, geno_removed = remove_rows(mt, mt.variant_metrics.call_rate < (1 - geno), reason)
 
     results = {
-        'geno_removed': len(geno_cr_remove)
+        'geno_removed': geno_removed
     }
 
     return mt, results
@@ -63,88 +240,107 @@ def filter_var_cr(mt: hl.MatrixTable, geno: float) -> Tuple[hl.MatrixTable, Dict
 
 def filter_sample_cr(mt: hl.MatrixTable, mind: float) -> Tuple[hl.MatrixTable, Dict[str, int]]:
     # step 2
-    mt = compute_qc_metrics(mt)
-
-    sample_miss = mt.filter_cols(mt.sample_qc.call_rate < (1 - mind))
-    sample_miss_cases = sample_miss.filter_cols(sample_miss.is_case == True).s.collect()
-    sample_miss_controls = sample_miss.filter_cols(sample_miss.is_case == False).s.collect()
-    n_sample_miss = len(sample_miss_cases) + len(sample_miss_controls)
-    samples_miss = sample_miss_cases + sample_miss_controls
-    if n_sample_miss > 0:
-        mt = mt.filter_cols(hl.literal(samples_miss).contains(mt['s']), keep=False)
+    sample_miss = hl.coalesce(mt.sample_metrics.call_rate < (1 - mind), False)
+    n_sample_miss = mt.aggregate_cols(hl.agg.filter(sample_included(mt), hl.struct(
+        cases=hl.agg.count_where(sample_miss & (mt.is_case == True)),
+        controls=hl.agg.count_where(sample_miss & (mt.is_case == False)))))
+    # samples with missing phenotype are not tested, same as before. The removed samples are the cases and controls
+    # counted above, remove_cols does not need its own aggregation
+    mt, _ = remove_cols(mt, sample_miss & hl.is_defined(mt.is_case), 'mind', count=False)
 
     results = {
-        'sample_miss_cases': len(sample_miss_cases),
-        'sample_miss_controls': len(sample_miss_controls)
+        'sample_miss_cases': n_sample_miss.cases,
+        'sample_miss_controls': n_sample_miss.controls
     }
 
     return mt, results
 
 
-def filter_sex_check(mt, fhet_y, fhet_x):
-    # step 3
-    imputed_sex = hl.impute_sex(mt.GT)
-    f_stat_out = mt.filter_cols(((imputed_sex[mt.s].f_stat < fhet_x) & (mt.is_female == False) |
-                                 (imputed_sex[mt.s].f_stat > fhet_y) & (mt.is_female == True))).s.collect()
-    if len(f_stat_out) > 0:
-        mt = mt.filter_cols(hl.literal(f_stat_out).contains(mt['s']), keep=False)
+def impute_sex(mt: hl.MatrixTable, aaf_threshold: float = 0.05) -> Tuple[hl.Table, Dict[str, int]]:
+    """
+    Impute sex once on common, biallelic non-PAR X variants. The result is shared by steps 3-5 and the F-stat plot
+    :param mt: Hail MatrixTable with variant_metrics
+    :param aaf_threshold: minimum alternate allele frequency of the X variants used
+    :return: checkpointed imputed sex Table keyed by s, number of X variants used
+    """
+    rg = mt.locus.dtype.reference_genome
+    # only the X contigs are read, the autosomes are never scanned
+    x_mt = hl.filter_intervals(included(mt),
+                               [hl.parse_locus_interval(contig, reference_genome=rg) for contig in rg.x_contigs])
+    x_mt = x_mt.filter_rows(x_mt.locus.in_x_nonpar() & (hl.len(x_mt.alleles) == 2) &
+                            (x_mt.variant_metrics.AF[1] >= aaf_threshold))
+    n_x_variants = x_mt.count_rows()
+
+    imputed_sex = hl.impute_sex(x_mt.GT, aaf_threshold=aaf_threshold).checkpoint(hl.utils.new_temp_file())
 
-    from .test_plots import fstat_plt
-    import pandas as pd
-    sex_check_plot = fstat_plt(imputed_sex, fhet_y, fhet_x)
-    sex_check_table = pd.DataFrame(f_stat_out, columns=['SampleID'])
+    results = {
+        'n_x_variants': n_x_variants
+    }
+
+    return imputed_sex, results
+
+
+def filter_sex_check(mt, imputed_sex, fhet_y, fhet_x):
+    # step 3
+    f_stat = imputed_sex[mt.s].f_stat
+    mt, sex_check_removed = remove_cols(mt, ((f_stat < fhet_x) & (mt.is_female == False)) |
+                                            ((f_stat > fhet_y) & (mt.is_female == True)), 'sex_check')
 
     results = {
-        'sex_check_removed': len(f_stat_out),
-        'sex_check_plot': sex_check_plot,
-        'sex_check_table': sex_check_table
+        'sex_check_removed': sex_check_removed
     }
 
     return mt, results
 
 
-def sex_violations(mt, input_type):
+def sex_violations(mt, imputed_sex, input_type):
     # step 4
-    imputed_sex = hl.impute_sex(mt.GT)
     if input_type == "plink":
-        # Verify that when sex info is missing value is set to None
-        sex_exclude = mt.filter_cols(
-            (mt.is_female != imputed_sex[mt.s].is_female) & (mt.is_female is not None)).s.collect()
+        reported_female = mt.is_female
     else:
         # Verify that when meta file is read in, column formatting is kept
-        sex_exclude = mt.filter_cols(
-            (mt.annotations.Sex != imputed_sex[mt.s].is_female) & (mt.annotations.Sex is not None)).s.collect()
+        reported_female = mt.annotations.Sex
 
-    if len(sex_exclude) > 0:
-        mt = mt.filter_cols(hl.literal(sex_exclude).contains(mt['s']), keep=False)
+    # samples with missing reported or imputed sex are not violations, the comparison is missing and they are kept
+    mt, sex_excluded = remove_cols(mt, reported_female != imputed_sex[mt.s].is_female, 'sex_violation')
 
     results = {
-        'sex_excluded': len(sex_exclude)
+        'sex_excluded': sex_excluded
     }
 
     return mt, results
 
 
-def sex_warnings(mt, input_type):
-    # step 5
+def sex_warnings(mt, imputed_sex, input_type):
+    # step 5: undefined reported sex or ambiguous (not imputed) genetic sex
     if input_type == "plink":
-        undef_count = mt.aggregate_cols(hl.agg.counter(mt.is_female is None))
+        reported_female = mt.is_female
     else:
-        undef_count = mt.aggregate_cols(hl.agg.counter(mt.annotations.Sex is None))
+        reported_female = mt.annotations.Sex
+
+    undef_count = mt.aggregate_cols(hl.agg.count_where(sample_included(mt) & (
+        hl.is_missing(reported_female) | hl.is_missing(imputed_sex[mt.s].is_female))))
 
     return undef_count
 
 
+def filter_midi(mt: hl.MatrixTable, midi: float) -> Tuple[hl.MatrixTable, Dict[str, int]]:
+    # step 7
+    mt, midi_removed = remove_rows(mt, mt.variant_metrics.missing_diff > midi, 'midi')
+
+    results = {
+        'midi_removed': midi_removed
+    }
+
+    return mt, results
+
+
 def filter_invariant_snps(mt: hl.MatrixTable) -> Tuple[hl.MatrixTable, Dict[str, int]]:
     # step 8
-    mt = compute_qc_metrics(mt)
-    mt = mt.annotate_rows(MAC=hl.min(mt.variant_qc.AC))
-    monomorphic_snps = mt.filter_rows(mt.MAC == 0).rsid.collect()
-    if len(monomorphic_snps) > 0:
-        mt = mt.filter_rows(hl.literal(monomorphic_snps).contains(mt['rsid']), keep=False)
+    mt, monomorphic_snps = remove_rows(mt, hl.min(mt.variant_metrics.AC) == 0, 'invariant')
 
     results = {
-        'monomorphic_snps': len(monomorphic_snps)
+        'monomorphic_snps': monomorphic_snps
     }
 
     return mt, results
@@ -152,14 +348,10 @@ def filter_invariant_snps(mt: hl.MatrixTable) -> Tuple[hl.MatrixTable, Dict[str,
 
 def filter_maf(mt: hl.MatrixTable, maf: float) -> Tuple[hl.MatrixTable, Dict[str, int]]:
     # step 9
-    mt = compute_qc_metrics(mt)
-    mt = mt.annotate_rows(maf=hl.min(mt.variant_qc.AF))
-    maf_removed = mt.filter_rows(mt.maf < maf).rsid.collect()
-    if len(maf_removed) > 0:
-        mt = mt.filter_rows(hl.literal(maf_removed).contains(mt['rsid']), keep=False)
+    mt, maf_removed = remove_rows(mt, hl.min(mt.variant_metrics.AF) < maf, 'maf')
 
     results = {
-        'maf_removed': len(maf_removed)
+        'maf_removed': maf_removed
     }
 
     return mt, results
@@ -167,27 +359,89 @@ def filter_maf(mt: hl.MatrixTable, maf: float) -> Tuple[hl.MatrixTable, Dict[str
 
 def filter_hwe(mt: hl.MatrixTable, pheno: str = None, hwe_threshold: float = None) -> Tuple[hl.MatrixTable, Dict[str, int]]:
     # steps 10 and 11
-    mt = compute_qc_metrics(mt)
     if pheno == 'Case':
-        if hwe_threshold:
-            hwe_thresh = hwe_threshold
-        else:
-            hwe_thresh = 1e-10
-        mt_pheno = mt.filter_cols(mt.is_case == True)
+        hwe_thresh = hwe_threshold if hwe_threshold else 1e-10
+        p_value_hwe = mt.variant_metrics.p_value_hwe_cases
+        reason = 'hwe_cases'
     else:
-        if hwe_threshold:
-            hwe_thresh = hwe_threshold
-        else:
-            hwe_thresh = 1e-06
-        mt_pheno = mt.filter_cols(mt.is_case == False)
+        hwe_thresh = hwe_threshold if hwe_threshold else 1e-06
+        p_value_hwe = mt.variant_metrics.p_value_hwe_controls
+        reason = 'hwe_controls'
 
-    snps = mt_pheno.filter_rows(mt_pheno.variant_qc.p_value_hwe < hwe_thresh).rsid.collect()
-    hwe_snps_removed = len(snps)
-    if hwe_snps_removed > 0:
-        mt = mt.filter_rows(hl.literal(snps).contains(mt['rsid']), keep=False)
+    mt, hwe_snps_removed = remove_rows(mt, p_value_hwe < hwe_thresh, reason)
 
     results = {
         'maf_removed': hwe_snps_removed
     }
 
     return mt, results
+
+
+# exclusion reason codes of steps 6-11, in order
+VARIANT_QC_REASONS = ['geno', 'midi', 'invariant', 'maf', 'hwe_controls', 'hwe_cases']
+
+
+def variant_qc(mt: hl.MatrixTable, geno: float, midi: float, maf: float, hwe_th_con: float, hwe_th_cas: float,
+               withpna: int = 0) -> Tuple[hl.MatrixTable, Dict[str, int]]:
+    """
+    Steps 6-11 in one pass. The steps only filter on variant_metrics, which do not change between them, so the
+    variant is attributed to the first step it fails and the counts are the same as running the steps one after the
+    other
+    :param mt: Hail MatrixTable with variant_metrics computed after sample QC
+    :return: filtered MatrixTable, number of variants removed by each step
+    """
+    vm = mt.variant_metrics
+    conditions = [vm.call_rate < (1 - geno),
+                  vm.missing_diff > midi,
+                  hl.min(vm.AC) == 0 if withpna == 0 else hl.bool(False),
+                  hl.min(vm.AF) < maf,
+                  vm.p_value_hwe_controls < hwe_th_con,
+                  vm.p_value_hwe_cases < hwe_th_cas]
+    first_failed = hl.case()
+    for step, condition in enumerate(conditions):
+        first_failed = first_failed.when(hl.coalesce(condition, False), VARIANT_QC_REASONS[step])
+    first_failed = hl.or_missing(variant_included(mt), first_failed.or_missing())
+
+    mt = mt.annotate_rows(variant_qc_step=first_failed)
+    step_counts = mt.aggregate_rows(hl.agg.counter(mt.variant_qc_step))
+    if 'variant_exclusion' in mt.row:
+        mt = mt.annotate_rows(variant_exclusion=hl.coalesce(mt.variant_exclusion, mt.variant_qc_step))
+        mt = mt.drop('variant_qc_step')
+    else:
+        mt = mt.filter_rows(hl.is_missing(mt.variant_qc_step)).drop('variant_qc_step')
+
+    results = {
+        'geno_removed': step_counts.get('geno', 0),
+        'midi_removed': step_counts.get('midi', 0),
+        'monomorphic_snps': step_counts.get('invariant', 0),
+        'maf_removed': step_counts.get('maf', 0),
+        'hwe_con_removed': step_counts.get('hwe_controls', 0),
+        'hwe_cas_removed': step_counts.get('hwe_cases', 0)
+    }
+
+    return mt, results
+
+
+def write_exclusions(mt: hl.MatrixTable, dirname: str, basename: str):
+    """
+    Write the excluded variants and samples with their reason codes as TSV.bgz and Parquet. Both are written by the
+    executors in parallel (one TSV.bgz shard per partition), nothing is collected to the driver
+    :param mt: Hail MatrixTable with exclusion codes
+    :param dirname: output directory
+    :param basename: data basename
+    """
+    variants = mt.rows()
+    variants = variants.filter(hl.is_defined(variants.variant_exclusion))
+    variants = variants.key_by()
+    variants = variants.select(contig=variants.locus.contig, position=variants.locus.position,
+                               alleles=hl.delimit(variants.alleles, ','), rsid=variants.rsid,
+                               reason=variants.variant_exclusion)
+
+    samples = mt.cols()
+    samples = samples.filter(hl.is_defined(samples.sample_exclusion))
+    samples = samples.select(is_case=samples.is_case, is_female=samples.is_female, reason=samples.sample_exclusion)
+
+    for name, ht in [('variant', variants), ('sample', samples)]:
+        path = '{}{}_{}_exclusions'.format(dirname, basename, name)
+        ht.export(path + '.tsv.bgz', parallel='header_per_shard')
+        ht.to_spark().write.mode('overwrite').parquet(path + '.parquet')
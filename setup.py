@@ -34,11 +34,12 @@ setup(name='preimp_qc',
       packages=find_packages(),
       entry_points={
           'console_scripts': [
-              'preimp_qc = preimp_qc.preimp_qc:main'
+              'preimp_qc = preimp_qc.preimp_qc:main',
+              'preimp_qc_batch = preimp_qc.batch:main'
           ]
       },
       classifiers=classifiers,
       keywords='',
-      install_requires=['hail', 'plotnine', 'matplotlib', 'qqman'],
+      install_requires=['hail', 'plotnine', 'matplotlib', 'pyarrow'],
       zip_safe=False
       )
\ No newline at end of file